@@ -0,0 +1,25 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+
+# with 'gevent', a worker handles other requests while waiting for
+# Bugzilla, hg.mozilla.org or the database
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+
+def post_worker_init(worker):
+    # the sockets are patched by the gevent worker but psycopg2 needs
+    # a wait callback to yield
+    if worker.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def child_exit(server, worker):
+    # remove the metrics of the dead worker from the shared directory
+    from mozreviewers import metrics
+    metrics.worker_exit(worker.pid)
@@ -2,10 +2,45 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from flask import request, jsonify
+from flask import request, jsonify, make_response
 import os
+from . import cache
+from . import metrics
 from . import models
 from . import reviewers
+from . import snapshot
+
+
+def cached_response(name, params, compute):
+    # the responses are the same until the data are updated
+    generation = cache.get_generation()
+    key = cache.get_key(name, params)
+    etag = '{}-{}'.format(generation, key[:20])
+    if request.if_none_match.contains(etag):
+        metrics.cache_lookup('etag', True)
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    data = cache.lookup(generation, key)
+    if data is None:
+        data = compute()
+        if data.get('degraded'):
+            # computed without an upstream: it mustn't be reused
+            return jsonify(data)
+        if not data.get('error'):
+            cache.store(generation, key, data)
+    response = jsonify(data)
+    response.set_etag(etag)
+    return response
+
+
+def get_filestats(files):
+    snap = snapshot.get_snapshot()
+    if snap is not None and files:
+        return {'stats': snap.get(files),
+                'error': ''}
+    return models.FilesStats.get(files)
 
 
 def authors():
@@ -15,7 +50,9 @@ def authors():
     elif request.method == 'POST':
         token = request.headers.get('token', '')
         if token == os.environ.get('POST_TOKEN', ''):
-            return jsonify(models.Authors.post(request.get_json()))
+            res = models.Authors.post(request.get_json())
+            cache.invalidate()
+            return jsonify(res)
         else:
             return jsonify(models.Authors.get(request.get_json()))
     return jsonify({})
@@ -23,17 +60,58 @@ def authors():
 
 def filestats():
     if request.method == 'GET':
-        files = request.args.getlist('file')
-        return jsonify(models.FilesStats.get(files))
+        files = sorted(set(request.args.getlist('file')))
+        return cached_response('filestats', {'files': files},
+                               lambda: get_filestats(files))
     elif request.method == 'POST':
         token = request.headers.get('token', '')
         if token == os.environ.get('POST_TOKEN', ''):
-            return jsonify(models.FilesStats.post(request.get_json()))
+            res = models.FilesStats.post(request.get_json())
+            cache.invalidate()
+            return jsonify(res)
         else:
             return jsonify(models.FileStats.get(request.get_json()))
     return jsonify({})
 
 
+def fileslines():
+    if request.method == 'GET':
+        files = request.args.getlist('file')
+        return jsonify(models.FilesLines.get(files))
+    elif request.method == 'POST':
+        token = request.headers.get('token', '')
+        if token == os.environ.get('POST_TOKEN', ''):
+            return jsonify(models.FilesLines.post(request.get_json()))
+    return jsonify({})
+
+
+def reviewload():
+    if request.method == 'GET':
+        return jsonify(models.ReviewLoad.get())
+    elif request.method == 'POST':
+        token = request.headers.get('token', '')
+        if token == os.environ.get('POST_TOKEN', ''):
+            return jsonify(models.ReviewLoad.post(request.get_json()))
+        else:
+            return jsonify(models.ReviewLoad.get())
+    return jsonify({})
+
+
+def components():
+    if request.method == 'GET':
+        if 'bugid' in request.args:
+            bugid = request.args['bugid']
+            return jsonify(models.ComponentsStats.get_for_bug(bugid))
+        product = request.args.get('product', '')
+        component = request.args.get('component', '')
+        return jsonify(models.ComponentsStats.get(product, component))
+    elif request.method == 'POST':
+        token = request.headers.get('token', '')
+        if token == os.environ.get('POST_TOKEN', ''):
+            return jsonify(models.ComponentsStats.post(request.get_json()))
+    return jsonify({})
+
+
 def reviewer():
     if request.method == 'POST':
         return jsonify(reviewers.get(request.get_json()))
@@ -42,9 +120,10 @@ def reviewer():
 
 def top():
     if request.method == 'GET':
-        files = request.args.getlist('file')
+        files = sorted(set(request.args.getlist('file')))
         number = int(request.args.get('number', 5))
-        return jsonify(reviewers.top(files, number))
+        return cached_response('top', {'files': files, 'number': number},
+                               lambda: reviewers.top(files, number))
     elif request.method == 'POST':
         return jsonify(reviewers.top(request.get_json()))
     return jsonify({})
@@ -2,20 +2,69 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from flask import Flask
+from flask import Flask, Response, g, request
 from flask_cors import CORS, cross_origin
 from flask_sqlalchemy import SQLAlchemy
 import os
+import time
+
+from . import metrics
+
+
+def get_engine_options(uri, timeout=0):
+    options = {'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING',
+                                               'true').lower() == 'true'}
+    if uri and not uri.startswith('sqlite'):
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+        options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+        options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    if timeout and uri and uri.startswith('postgres'):
+        # in ms: the queries made when handling a request mustn't wait
+        # behind a slow batch of writes
+        timeout = '-c statement_timeout={}'.format(timeout)
+        options['connect_args'] = {'options': timeout}
+    return options
 
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+    get_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# the reads are made on the replica when there is one
+app.config['DATABASE_REPLICA_URL'] = os.environ.get('DATABASE_REPLICA_URL',
+                                                    '')
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT',
+                                                        5000))
+# 'auto' (only with PostgreSQL), 'true' or 'false'
+app.config['SQL_AGGREGATION'] = os.environ.get('SQL_AGGREGATION', 'auto')
 db = SQLAlchemy(app)
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
 
 
+@app.before_request
+def start_timer():
+    g.start = time.time()
+
+
+@app.after_request
+def stop_timer(response):
+    if 'start' in g:
+        duration = time.time() - g.start
+        metrics.observe_request(request.endpoint, request.method, duration)
+    return response
+
+
+@app.teardown_appcontext
+def remove_read_session(exception=None):
+    # the models are imported with the first request, so the teardown
+    # can't be registered there
+    from . import models
+    models.remove_read_session()
+
+
 @app.route('/authors', methods=['GET', 'POST'])
 @cross_origin()
 def authors():
@@ -30,6 +79,27 @@ def filestats():
     return api.filestats()
 
 
+@app.route('/fileslines', methods=['GET', 'POST'])
+@cross_origin()
+def fileslines():
+    from . import api
+    return api.fileslines()
+
+
+@app.route('/reviewload', methods=['GET', 'POST'])
+@cross_origin()
+def reviewload():
+    from . import api
+    return api.reviewload()
+
+
+@app.route('/components', methods=['GET', 'POST'])
+@cross_origin()
+def components():
+    from . import api
+    return api.components()
+
+
 @app.route('/reviewers', methods=['POST'])
 @cross_origin()
 def reviewer():
@@ -44,5 +114,11 @@ def top():
     return api.top()
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    data, content_type = metrics.export()
+    return Response(data, mimetype=content_type)
+
+
 if __name__ == '__main__':
     app.run()
@@ -2,12 +2,11 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from copy import deepcopy
 import logging
 from multiprocessing import Pool, cpu_count
-from nltk.util import ngrams
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
+
+from . import profiling
 
 
 PAT = re.compile('<|>|@|\.com|\.de|\.fr|\.co\.uk|\.net|\.org|\.| |bugzilla'
@@ -16,6 +15,8 @@ MAIL_PAT = re.compile('<([^>]*)>')
 
 
 def normalize(text, ngram=3):
+    from nltk.util import ngrams
+
     text = text.lower()
     text = PAT.sub('', text)
     toks = [''.join(n) for n in ngrams(text, ngram)]
@@ -23,6 +24,10 @@ def normalize(text, ngram=3):
 
 
 def cosine(t1, t2):
+    # sklearn and nltk are only needed to match the names of the authors
+    # which can't be found in the bugs
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
     vectorizer = TfidfVectorizer(tokenizer=normalize)
     tfidf = vectorizer.fit_transform([t1, t2])
     return ((tfidf * tfidf.T).A)[0, 1]
@@ -33,12 +38,13 @@ def update(author_to_bz, res):
         author_to_bz[author] = name
 
 
-def collect_bzmail_1(author_to_bz, authors):
+def collect_bzmail_1(author_to_bz, stats, todo):
     # we can expect that an author is also the bug assignee
     # so we get the bugzilla email which is the more used
     # as assignee for an author
     res = {}
-    for author, info in authors.items():
+    for author in todo:
+        info = stats[author]
         assignees = info['assignees']
         if assignees:
             main_assignee, M = max(assignees.items(), key=lambda p: p[1])
@@ -59,19 +65,19 @@ def collect_bzmail_1(author_to_bz, authors):
                 if len(s) == 1:
                     res[author] = list(s)[0]
 
-    for author in res.keys():
-        del authors[author]
+    todo.difference_update(res.keys())
     update(author_to_bz, res)
 
 
-def collect_bzmail_2(author_to_bz, authors):
+def collect_bzmail_2(author_to_bz, stats, todo):
     # the hg author can be "Andrew Scheff <ascheff@mozilla.com>"
     # or "brendan@mozilla.org".
     # So here get the mail from author and check if this mail is corresponding
     # to an email in assignees, attachers, reviewees or commenters
     fields = ['assignees', 'attachers', 'reviewees', 'commenters']
     res = {}
-    for author, info in authors.items():
+    for author in todo:
+        info = stats[author]
         persons = set(k for f in fields for k in info[f].keys())
         m = MAIL_PAT.search(author)
         if m:
@@ -81,18 +87,18 @@ def collect_bzmail_2(author_to_bz, authors):
         elif author in persons:
             res[author] = author
 
-    for author in res.keys():
-        del authors[author]
+    todo.difference_update(res.keys())
     update(author_to_bz, res)
 
 
-def collect_bzmail_3(mailnames, author_to_bz, authors, threshold):
+def collect_bzmail_3(mailnames, author_to_bz, stats, todo, threshold):
     # get all the people involved in the bug and try to find one where
     # the hg author is closed (according to threshold) to one
     # of this people
     fields = ['assignees', 'attachers', 'reviewees', 'commenters']
     res = {}
-    for author, info in authors.items():
+    for author in todo:
+        info = stats[author]
         persons = set(k for f in fields for k in info[f].keys())
         for p in persons:
             c = cosine(author, p)
@@ -110,8 +116,7 @@ def collect_bzmail_3(mailnames, author_to_bz, authors, threshold):
                 if added:
                     break
 
-    for author in res.keys():
-        del authors[author]
+    todo.difference_update(res.keys())
     update(author_to_bz, res)
 
 
@@ -129,12 +134,15 @@ def __compute_helper(args):
     return compute(*args)
 
 
-def collect_bzmail_4(author_to_bz, authors, threshold):
+def collect_bzmail_4(author_to_bz, todo, threshold):
     def chunks(l, chunk_size):
         for i in range(0, len(l), chunk_size):
             yield l[i:(i + chunk_size)]
 
-    all_authors = list(authors.keys())
+    all_authors = list(todo)
+    if not all_authors:
+        return
+
     Np = cpu_count()
     Np = Np - 1 if Np > 1 else Np
     N = int(1 + len(all_authors) // Np)
@@ -148,14 +156,14 @@ def collect_bzmail_4(author_to_bz, authors, threshold):
     pool = Pool(processes=Np)
     results = pool.map(__compute_helper, args)
     res = {k: v for r in results for k, v in r.items()}
-    for author in res.keys():
-        del authors[author]
+    todo.difference_update(res.keys())
     update(author_to_bz, res)
 
 
-def collect_bzmail_5(author_to_bz, authors):
+def collect_bzmail_5(author_to_bz, stats, todo):
     res = {}
-    for author, info in authors.items():
+    for author in todo:
+        info = stats[author]
         assignees = info['assignees']
         if len(assignees) == 1:
             res[author] = list(assignees.keys())[0]
@@ -193,8 +201,7 @@ def collect_bzmail_5(author_to_bz, authors):
                     msg = msg.format(author)
                     logging.info(author)
 
-    for author in res.keys():
-        del authors[author]
+    todo.difference_update(res.keys())
     update(author_to_bz, res)
 
 
@@ -226,17 +233,30 @@ def print_for_names(names, res):
     print_res({n: res[n] for n in names if n in res})
 
 
-def get_map_hg_bz(stats):
-    # make a deepcopy because we need to save the stats
-    # and the entries in this dict will be deleted
-    stats_by_author = deepcopy(stats['stats'])
+def get_map_hg_bz(stats, authors=None, known=None):
+    # only the given authors are resolved (all by default) and known is the
+    # mapping already computed for the others.
+    # the stats are only read: each pass removes the authors it has resolved
+    # from the set of the unresolved ones
     mailnames = stats['mailnames']
-    atb = {}
-
-    collect_bzmail_1(atb, stats_by_author)
-    collect_bzmail_2(atb, stats_by_author)
-    collect_bzmail_3(mailnames, atb, stats_by_author, 0.4)
-    collect_bzmail_4(atb, stats_by_author, 0.4)
-    collect_bzmail_5(atb, stats_by_author)
+    stats = stats['stats']
+    todo = set(stats.keys() if authors is None else authors)
+    atb = dict(known) if known else {}
+
+    with profiling.stage('collect_bzmail_1') as counts:
+        collect_bzmail_1(atb, stats, todo)
+        counts['mapped'] = len(atb)
+    with profiling.stage('collect_bzmail_2') as counts:
+        collect_bzmail_2(atb, stats, todo)
+        counts['mapped'] = len(atb)
+    with profiling.stage('collect_bzmail_3') as counts:
+        collect_bzmail_3(mailnames, atb, stats, todo, 0.4)
+        counts['mapped'] = len(atb)
+    with profiling.stage('collect_bzmail_4') as counts:
+        collect_bzmail_4(atb, todo, 0.4)
+        counts['mapped'] = len(atb)
+    with profiling.stage('collect_bzmail_5') as counts:
+        collect_bzmail_5(atb, stats, todo)
+        counts['mapped'] = len(atb)
 
     return atb
@@ -6,6 +6,8 @@ from libmozdata.bugzilla import Bugzilla
 from collections import defaultdict
 import re
 
+from . import outbound
+
 
 REVIEW_PAT = re.compile(r'review\?\(([^\)]*)\)')
 
@@ -24,7 +26,7 @@ def history_handler(history, data):
     data[bugid]['history'] = history
 
 
-def get_bugs(bugids):
+def fetch_bugs(bugids):
     data = {bugid: {} for bugid in bugids}
     Bugzilla(bugids=bugids,
              bughandler=bug_handler,
@@ -36,6 +38,13 @@ def get_bugs(bugids):
     return data
 
 
+def get_bugs(bugids):
+    # the collector waits as long as needed but doesn't insist
+    # when Bugzilla keeps failing
+    bugids = list(bugids)
+    return outbound.call('bugzilla', None, fetch_bugs, bugids, timeout=None)
+
+
 def get_attachers(comments, attachers, commenters):
     for comment in comments:
         author = comment['author']
@@ -74,6 +83,26 @@ def get_reviewers(history, reviewees, reviewers):
                     reviewers.add(reviewer)
 
 
+def get_open_reviews(history):
+    # a review request is open until its flag is removed
+    # (granted, denied or cancelled)
+    pending = set()
+    for h in history:
+        for c in h['changes']:
+            fn = c['field_name']
+            attachment = c.get('attachment_id', '')
+            if fn == 'flagtypes.name' and attachment:
+                for reviewer in REVIEW_PAT.findall(c.get('removed', '')):
+                    pending.discard((attachment, reviewer))
+                for reviewer in REVIEW_PAT.findall(c['added']):
+                    pending.add((attachment, reviewer))
+
+    res = defaultdict(lambda: 0)
+    for _, reviewer in pending:
+        res[reviewer] += 1
+    return dict(res)
+
+
 def get_pc(bug):
     product = bug['product']
     component = bug['component']
@@ -100,12 +129,14 @@ def get_bugs_info(bugids):
         reviewers = set()
         get_reviewers(history, reviewees, reviewers)
         reviewers = list(reviewers)
+        open_reviews = get_open_reviews(history)
         product, component = get_pc(bug)
         res[bugid] = {'assignee': assignee,
                       'attachers': attachers,
                       'commenters': commenters,
                       'reviewees': reviewees,
                       'reviewers': reviewers,
+                      'open_reviews': open_reviews,
                       'product': product,
                       'component': component}
 
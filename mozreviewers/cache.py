@@ -0,0 +1,138 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import metrics
+from . import snapshot
+from .models import Generation
+
+
+GENERATION_TTL = float(os.environ.get('GENERATION_TTL', 10))
+CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', '')
+
+# the data generation, reloaded every GENERATION_TTL seconds
+_generation = {'number': 0,
+               'time': None}
+_cache = {}
+
+
+def get_generation():
+    now = time.time()
+    t = _generation['time']
+    if t is None or now - t > GENERATION_TTL:
+        _generation['number'] = Generation.get()['generation']
+        _generation['time'] = now
+
+    snap = snapshot.get_snapshot()
+    if snap is not None:
+        # the lines and the components are still in the database: both
+        # numbers only increase, so their sum changes with any of them
+        return snap.generation + _generation['number']
+    return _generation['number']
+
+
+def invalidate():
+    # the data have been changed by this process
+    _generation['time'] = None
+
+
+def get_key(name, params):
+    key = json.dumps([name, params], sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class MemoryCache(object):
+    # LRU cache local to the process
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, generation, key):
+        with self.lock:
+            value = self.data.pop((generation, key), None)
+            if value is not None:
+                self.data[(generation, key)] = value
+            return value
+
+    def set(self, generation, key, value):
+        with self.lock:
+            self.data.pop((generation, key), None)
+            self.data[(generation, key)] = value
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+
+class FileCache(object):
+    # one file per entry in a directory shared by the gunicorn workers:
+    # the entries of a generation are in a subdirectory removed once
+    # a newer generation is used
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.generation = None
+
+    def get_dir(self, generation):
+        return os.path.join(self.directory, str(generation))
+
+    def get(self, generation, key):
+        path = os.path.join(self.get_dir(generation), key + '.json')
+        try:
+            with open(path, 'r') as In:
+                return json.load(In)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, generation, key, value):
+        directory = self.get_dir(generation)
+        if self.generation != generation:
+            self.generation = generation
+            self.cleanup(generation)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as Out:
+                json.dump(value, Out)
+            # a reader gets the whole entry or nothing
+            os.rename(tmp, os.path.join(directory, key + '.json'))
+        except (IOError, OSError):
+            pass
+
+    def cleanup(self, generation):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.isdigit() and int(name) < generation:
+                path = os.path.join(self.directory, name)
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def get_cache():
+    if 'cache' not in _cache:
+        if CACHE_DIR:
+            _cache['cache'] = FileCache(CACHE_DIR)
+        else:
+            _cache['cache'] = MemoryCache(CACHE_SIZE)
+    return _cache['cache']
+
+
+def lookup(generation, key):
+    value = get_cache().get(generation, key)
+    metrics.cache_lookup('response', value is not None)
+    return value
+
+
+def store(generation, key, value):
+    get_cache().set(generation, key, value)
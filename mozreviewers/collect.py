@@ -3,17 +3,44 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import defaultdict
+from datetime import datetime
+import heapq
 import json
 from libmozdata import gmail, utils as lmdutils
 import logging
 import os
 import requests
-
-from .hgdata import get_hg_info
+import signal
+import six
+import time
+
+from . import filescores
+from . import pathfilter
+from . import profiling
+from . import snapshot
+from .hgdata import get_repos_info, prune_nodes, get_lines_histograms
 from .bzdata import get_bugs_info
 from .authors import get_map_hg_bz
 
 
+# the authors without patch for this number of days are inactive
+INACTIVE_DAYS = 92
+# the open review requests of a bug without new changeset for this number
+# of days aren't counted anymore (they have likely been answered)
+REVIEW_LOAD_DAYS = 30
+
+
+def load_json(path, jsons, default=None):
+    # jsons contains the data to write at the end of the run: the daemon
+    # keeps them between two runs, so the files are only read once
+    if path in jsons:
+        return jsons[path]
+    if os.path.isfile(path):
+        with open(path, 'r') as In:
+            return json.load(In)
+    return default
+
+
 def push(payload, service, post_info):
     url = post_info['url']
     if not url.endswith('/'):
@@ -42,60 +69,203 @@ def push_diff_files(diff, post_info):
     return push(payload, 'filestats', post_info)
 
 
-def update_file_stats(patches, buginfo, mapping,
-                      fstats_path, post_info, jsons):
-    logging.info('Update file stats')
-    with open(fstats_path, 'r') as In:
-        old = json.load(In)
+def push_diff_load(diff, post_info):
+    payload = {'command': 'update',
+               'data': diff}
+    return push(payload, 'reviewload', post_info)
+
+
+def update_review_load(buginfo, load_path, post_info, jsons, today=None):
+    # the open review requests are counted per bug, so when a bug is seen
+    # again its previous counts are replaced by the new ones, and they're
+    # removed when it isn't seen for REVIEW_LOAD_DAYS days
+    logging.info('Update review load')
+    if today is None:
+        today = get_today()
+    old = load_json(load_path, jsons, {'bugs': {},
+                                       'reviewers': {},
+                                       'seen': {}})
+
+    bugs = old['bugs']
+    totals = old['reviewers']
+    if 'seen' not in old:
+        # bugid => last day the bug was seen
+        old['seen'] = {bugid: today for bugid in bugs}
+    seen = old['seen']
+    changed = set()
+    for bugid, info in buginfo.items():
+        bugid = str(bugid)
+        new = info['open_reviews']
+        for reviewer, n in bugs.get(bugid, {}).items():
+            totals[reviewer] -= n
+            changed.add(reviewer)
+        for reviewer, n in new.items():
+            totals[reviewer] = totals.get(reviewer, 0) + n
+            changed.add(reviewer)
+        if new:
+            bugs[bugid] = new
+            seen[bugid] = today
+        elif bugid in bugs:
+            del bugs[bugid]
+            del seen[bugid]
+
+    expired = [bugid for bugid, day in seen.items()
+               if day + REVIEW_LOAD_DAYS < today]
+    for bugid in expired:
+        del seen[bugid]
+        for reviewer, n in bugs.pop(bugid).items():
+            totals[reviewer] -= n
+            changed.add(reviewer)
+
+    diff = {}
+    for reviewer in changed:
+        diff[reviewer] = totals[reviewer]
+        if totals[reviewer] <= 0:
+            del totals[reviewer]
+
+    if diff:
+        push_diff_load(diff, post_info)
+
+    jsons[load_path] = old
+
+
+def push_diff_components(diff, post_info):
+    payload = {'command': 'update',
+               'data': diff}
+    return push(payload, 'components', post_info)
+
+
+def update_components(patches, buginfo, mapping, pc_path, post_info, jsons):
+    # score the people per (product, component) in the same way as
+    # for the files: it's used as a fallback for the files without stats
+    logging.info('Update components stats')
+    old = load_json(pc_path, jsons, {'scores': {},
+                                     'bugs': {}})
 
-    diff_files = defaultdict(lambda: set())
+    scores = old['scores']
+    bugs = old['bugs']
+    diff_scores = defaultdict(lambda: set())
+    diff_bugs = {}
     for patch in patches:
         bugid = patch['bugid']
-        if bugid not in buginfo:
+        if bugid not in buginfo or patch['author'] not in mapping:
+            # see filescores.get_contributions
             continue
 
-        author = patch['author']
-        files = patch['files']
-        touched = files['touched']
-        added = files['added']
-        moved = files['moved']
-
-        reviewers = buginfo[bugid]['reviewers']
-        bzauthor = mapping[author]
-        files = touched
-
-        for f in touched:
-            if f not in old:
-                old[f] = {}
-
-        for f in added:
-            files.append(f)
-            old[f] = {}
-
-        for o, n in moved.items():
-            files.append(n)
-            old[n] = old[o] if o in old else {}
-            diff_files[n] |= set(old[n].keys())
-
-        for f in files:
-            for reviewer in reviewers:
-                diff_files[f].add(reviewer)
-                if reviewer in old[f]:
-                    old[f][reviewer] += 0.4
-                else:
-                    old[f][reviewer] = 0.4
-
-            diff_files[f].add(bzauthor)
-            if bzauthor in old[f]:
-                old[f][bzauthor] += 0.6
-            else:
-                old[f][bzauthor] = 0.6
+        info = buginfo[bugid]
+        pc = '{}::{}'.format(info['product'], info['component'])
+        if bugs.get(str(bugid)) != pc:
+            bugs[str(bugid)] = pc
+            diff_bugs[bugid] = {'product': info['product'],
+                                'component': info['component']}
+
+        if pc not in scores:
+            scores[pc] = {}
+        pc_scores = scores[pc]
+        contribs = [(r, filescores.REVIEWER_SCORE) for r in info['reviewers']]
+        contribs.append((mapping[patch['author']], filescores.AUTHOR_SCORE))
+        for person, score in contribs:
+            filescores.add_score(pc_scores, person, score)
+            diff_scores[pc].add(person)
+
+    diff = {'scores': {},
+            'bugs': diff_bugs}
+    for pc, persons in diff_scores.items():
+        product, component = pc.split('::', 1)
+        diff['scores'][pc] = {'product': product,
+                              'component': component,
+                              'scores': {p: scores[pc][p] for p in persons}}
+
+    if diff['scores'] or diff['bugs']:
+        push_diff_components(diff, post_info)
+
+    jsons[pc_path] = old
+
+
+def push_diff_lines(diff, post_info):
+    payload = {'command': 'update',
+               'data': diff}
+    return push(payload, 'fileslines', post_info)
+
 
-    diff = defaultdict(lambda: dict())
-    for f, authors in diff_files.items():
-        for author in authors:
-            diff[f][author] = old[f][author]
-    diff = dict(diff)
+def update_files_lines(patches, lines_path, post_info, jsons, min_lines):
+    # the number of lines per author of the large files, used to estimate
+    # their annotations: they're computed again when the files change,
+    # in the repository of the last patch changing them
+    logging.info('Update files lines')
+    old = load_json(lines_path, jsons, {})
+    files = {}
+    for patch in patches:
+        changed = patch['files']['touched'] + patch['files']['added'] + \
+            list(patch['files']['moved'].values())
+        changed += [f for f in patch['files']['moved'].keys() if f in old]
+        changed += [f for f in patch['files']['deleted'] if f in old]
+        for f in changed:
+            files[f] = patch['repo']
+
+    by_repo = defaultdict(lambda: [])
+    for f, hgpath in files.items():
+        by_repo[hgpath].append(f)
+
+    diff = {}
+    with profiling.stage('get_lines_histograms') as counts:
+        histograms = {}
+        for hgpath, repo_files in by_repo.items():
+            histograms.update(get_lines_histograms(hgpath, repo_files,
+                                                   min_lines))
+        for f, histo in histograms.items():
+            if histo:
+                old[f] = histo
+                diff[f] = histo
+            elif f in old:
+                # the file is now too small or has been removed
+                del old[f]
+                diff[f] = {}
+        counts['files'] = len(files)
+        counts['large'] = len(old)
+
+    if diff:
+        push_diff_lines(diff, post_info)
+
+    jsons[lines_path] = old
+
+
+def purge_excluded(old):
+    # the files scored before they were excluded: a null score removes
+    # the row in the database
+    excluded = [f for f in old.keys() if pathfilter.is_excluded(f)]
+    diff = {f: {author: 0 for author in old.pop(f)} for f in excluded}
+    if excluded:
+        logging.info('Excluded files: {}'.format(len(excluded)))
+    return diff
+
+
+def update_file_stats(patches, buginfo, mapping,
+                      fstats_path, post_info, jsons, workers=None,
+                      backouts=[], landed_path=None, purge=False):
+    # the contributions of the changesets landed recently are kept in
+    # landed_path: when one of them is backed out, its scores are removed.
+    # With purge, the files excluded since the last purge are removed
+    logging.info('Update file stats')
+    old = load_json(fstats_path, jsons, {})
+    excluded = purge_excluded(old) if purge else {}
+
+    with profiling.stage('update_file_stats') as counts:
+        contributions = filescores.get_contributions(patches, buginfo,
+                                                     mapping)
+        if landed_path:
+            landed = load_json(landed_path, jsons, {})
+            filescores.index_contributions(landed, contributions)
+            reversals = filescores.get_reversals(landed, backouts)
+            filescores.prune_landed(landed)
+            contributions += reversals
+            counts['reversals'] = len(reversals)
+            jsons[landed_path] = landed
+        diff = filescores.update(old, contributions, workers=workers)
+        diff.update(excluded)
+        counts['contributions'] = len(contributions)
+        counts['files'] = len(old)
+        counts['diff'] = len(diff)
 
     if diff:
         push_diff_files(diff, post_info)
@@ -103,93 +273,234 @@ def update_file_stats(patches, buginfo, mapping,
     jsons[fstats_path] = old
 
 
-def update_mapping(stats, mapping_path, post_info, jsons):
-    logging.info('Update mapping')
-    full_mapping = get_map_hg_bz(stats)
-    mapping = remove_obsolete(full_mapping, stats['stats'])
-    old = {}
+def get_aliases(mapping):
+    # bzauthor => its hg authors
+    aliases = defaultdict(lambda: set())
+    for hga, bza in mapping.items():
+        aliases[bza].add(hga)
+    return aliases
 
-    if os.path.isfile(mapping_path):
-        with open(mapping_path, 'r') as In:
-            old = json.load(In)
 
-    torm = set(old.keys()) - set(mapping.keys())
-    diff = {'torm': list(torm),
+def update_aliases(aliases, previous, full_mapping, hgauthors):
+    for hga in hgauthors:
+        old_bza = previous.get(hga)
+        new_bza = full_mapping.get(hga)
+        if old_bza == new_bza:
+            continue
+        if old_bza in aliases and hga in aliases[old_bza]:
+            aliases[old_bza].remove(hga)
+            if not aliases[old_bza]:
+                del aliases[old_bza]
+        if new_bza is not None:
+            aliases.setdefault(new_bza, []).append(hga)
+
+
+def get_mapping_diff(old, full_mapping, aliases, stats, today, changed):
+    # only the bz authors of the changed hg authors can change
+    bzauthors = set()
+    for hga in changed:
+        for mapping in [old, full_mapping]:
+            if hga in mapping:
+                bzauthors.add(mapping[hga])
+    hgauthors = set(changed)
+    active = set()
+    for bza in bzauthors:
+        hgas = aliases.get(bza, [])
+        hgauthors.update(hgas)
+        if any(is_active(stats, hga, today) for hga in hgas):
+            active.add(bza)
+
+    diff = {'torm': [],
             'toinsert': {}}
-    for hga, bza in mapping.items():
-        if hga not in old or old[hga] != bza:
-            diff['toinsert'][hga] = bza
-
+    for hga in hgauthors:
+        bza = full_mapping.get(hga)
+        if bza in active:
+            if old.get(hga) != bza:
+                diff['toinsert'][hga] = bza
+        elif hga in old:
+            diff['torm'].append(hga)
+    return diff
+
+
+def update_mapping(stats, mapping_path, post_info, jsons,
+                   full_mapping_path=None, authors=None):
+    # when the full mapping of the previous run is available, only the
+    # authors whose stats changed (authors) or who are unmapped are resolved
+    # and only them and the ones who have become inactive are checked
+    logging.info('Update mapping')
+    today = get_today()
+    expired = pop_expired(stats, today)
+    known = None
+    if full_mapping_path and authors is not None:
+        known = load_json(full_mapping_path, jsons)
+    if known is not None:
+        previous = known
+        todo = [a for a in stats['stats'] if a in authors or a not in known]
+        known = {a: b for a, b in known.items() if a not in authors}
+        logging.info('Incremental mapping: {} authors'.format(len(todo)))
+    else:
+        todo = None
+        logging.info('Full mapping')
+
+    with profiling.stage('get_map_hg_bz') as counts:
+        full_mapping = get_map_hg_bz(stats, authors=todo, known=known)
+        counts['authors'] = len(stats['stats'] if todo is None else todo)
+        counts['mapped'] = len(full_mapping)
+    old = load_json(mapping_path, jsons, {})
+
+    if todo is None:
+        aliases = get_aliases(full_mapping)
+        stats['aliases'] = {k: list(v) for k, v in aliases.items()}
+        mapping = remove_obsolete(full_mapping, stats['stats'], today)
+        torm = set(old.keys()) - set(mapping.keys())
+        diff = {'torm': list(torm),
+                'toinsert': {}}
+        for hga, bza in mapping.items():
+            if hga not in old or old[hga] != bza:
+                diff['toinsert'][hga] = bza
+    else:
+        if 'aliases' not in stats:
+            # data from an older version
+            aliases = get_aliases(previous)
+            stats['aliases'] = {k: list(v) for k, v in aliases.items()}
+        aliases = stats['aliases']
+        update_aliases(aliases, previous, full_mapping, todo)
+        diff = get_mapping_diff(old, full_mapping, aliases, stats['stats'],
+                                today, set(todo) | expired)
+        mapping = old
+        for hga in diff['torm']:
+            del mapping[hga]
+        mapping.update(diff['toinsert'])
+
+    logging.info('Expired authors: {}'.format(len(expired)))
     logging.info('Diff mapping: {}'.format(diff))
     if diff['torm'] or diff['toinsert']:
         push_diff_authors(diff, post_info)
 
     jsons[mapping_path] = mapping
+    if full_mapping_path:
+        jsons[full_mapping_path] = full_mapping
 
     return full_mapping
 
 
-def update_last_date(stats, patches):
-    stats = stats['stats']
-    for patch in patches:
-        hgauthor = patch['author']
-        date = patch['date']
-        date = lmdutils.get_date_ymd(date)
-        last = stats[hgauthor]['last_patch_date']
-        if not last:
-            stats[hgauthor]['last_patch_date'] = patch['date']
-        else:
-            last = lmdutils.get_date_ymd(last)
-            if date > last:
-                stats[hgauthor]['last_patch_date'] = patch['date']
-
+def get_day(date):
+    # 'YYYY-MM-DD' => day ordinal
+    return datetime.strptime(date, '%Y-%m-%d').toordinal()
 
-def remove_obsolete(mapping, stats):
-    mapping = mapping.copy()
-    rev = defaultdict(lambda: set())
-    for k, v in mapping.items():
-        rev[v].add(k)
 
-    potential = set()
-    for hgauthor, info in stats.items():
-        last = info['last_patch_date']
-        last = lmdutils.get_date_ymd(last)
-        today = lmdutils.get_date_ymd('today')
-        if (today - last).days > 92 and hgauthor in mapping:
-            potential.add(hgauthor)
+def get_today():
+    return datetime.utcnow().toordinal()
 
-    for hgauthor in potential:
-        bzauthor = mapping[hgauthor]
-        if rev[bzauthor] <= potential:
-            del mapping[hgauthor]
 
-    return mapping
+def init_activity(stats):
+    # the last day of activity of each author (as a day ordinal) and a heap
+    # of [day after which they're inactive, hgauthor], built once for the
+    # data of an older version
+    if 'expiries' in stats:
+        return
+    expiries = []
+    for hgauthor, info in stats['stats'].items():
+        last = info['last_patch_date']
+        info['last_day'] = get_day(last) if last else 0
+        if last:
+            expiries.append([info['last_day'] + INACTIVE_DAYS, hgauthor])
+    heapq.heapify(expiries)
+    stats['expiries'] = expiries
 
 
-def get_stats(hgpath, data_path, jsons, useless=set()):
-    if os.path.isfile(data_path):
-        with open(data_path, 'r') as In:
-            old = json.load(In)
-            last_rev = old['last_rev']
-    else:
+def update_last_date(stats, patches):
+    expiries = stats['expiries']
+    stats = stats['stats']
+    days = {}
+    for patch in patches:
+        hgauthor = patch['author']
+        if hgauthor not in stats:
+            continue
+        date = patch['date']
+        if date not in days:
+            days[date] = get_day(date)
+        day = days[date]
+        info = stats[hgauthor]
+        if day > info['last_day']:
+            info['last_day'] = day
+            info['last_patch_date'] = date
+            # the previous entry of the author will be ignored
+            heapq.heappush(expiries, [day + INACTIVE_DAYS, hgauthor])
+
+
+def pop_expired(stats, today):
+    # the authors who have become inactive since the last call
+    expiries = stats['expiries']
+    stats = stats['stats']
+    expired = set()
+    while expiries and expiries[0][0] < today:
+        expiry, hgauthor = heapq.heappop(expiries)
+        info = stats.get(hgauthor)
+        if info is not None and info['last_day'] + INACTIVE_DAYS == expiry:
+            expired.add(hgauthor)
+    return expired
+
+
+def is_active(stats, hgauthor, today):
+    info = stats.get(hgauthor)
+    return info is not None and info['last_day'] + INACTIVE_DAYS >= today
+
+
+def remove_obsolete(mapping, stats, today):
+    # an author is kept while one of the hg authors of its bz author
+    # is active
+    aliases = get_aliases(mapping)
+    active = set()
+    for bza, hgas in aliases.items():
+        if any(is_active(stats, hga, today) for hga in hgas):
+            active.add(bza)
+    return {hga: bza for hga, bza in mapping.items() if bza in active}
+
+
+def get_stats(hgpaths, data_path, jsons, useless=set(), limit=None):
+    # hgpaths is a path or a list of paths: each repository has its own
+    # last revision. The first returned value is the number of processed
+    # changesets (see get_repos_info)
+    if isinstance(hgpaths, six.string_types):
+        hgpaths = [hgpaths]
+    old = load_json(data_path, jsons)
+    if old is None:
         old = {'mailnames': {},
                'stats': {},
-               'last_rev': ''}
-        last_rev = '0'
-
-    logging.info('Last revision: {}'.format(last_rev))
-    last_rev, hgdata, bugids, patches = get_hg_info(hgpath,
-                                                    last_rev,
-                                                    rev='tip')
-    logging.info('New last revision: {}'.format(last_rev))
-
-    if last_rev:
+               'last_revs': {},
+               'nodes': {}}
+    elif 'last_revs' not in old:
+        # data from a single repository
+        last_rev = old.pop('last_rev')
+        old['last_revs'] = {hgpaths[0]: last_rev} if last_rev else {}
+        old['nodes'] = {}
+    last_revs = old['last_revs']
+    init_activity(old)
+
+    logging.info('Last revisions: {}'.format(last_revs))
+    with profiling.stage('get_hg_info') as counts:
+        new_revs, hgdata, bugids, patches, backouts, count = \
+            get_repos_info(hgpaths, last_revs, old['nodes'],
+                           rev='tip', limit=limit)
+        if new_revs:
+            counts['changesets'] = count
+            counts['patches'] = len(patches)
+            counts['backouts'] = len(backouts)
+            counts['bugs'] = len(bugids)
+            counts['authors'] = len(hgdata)
+    logging.info('New last revisions: {}'.format(new_revs))
+
+    if new_revs:
         fields = ['attachers', 'commenters', 'reviewees']
         logging.info('Retrieve bugs information')
-        bi = get_bugs_info(bugids)
+        with profiling.stage('get_bugs_info') as counts:
+            bi = get_bugs_info(bugids)
+            counts['bugs'] = len(bi['info'])
         buginfo = bi['info']
         mailnames = bi['mailnames']
-        old['last_rev'] = last_rev
+        last_revs.update(new_revs)
+        prune_nodes(old['nodes'])
         stats = old['stats']
 
         logging.info('Compute statistics')
@@ -202,7 +513,8 @@ def get_stats(hgpath, data_path, jsons, useless=set()):
                                    'attachers': {},
                                    'commenters': {},
                                    'reviewees': {},
-                                   'last_patch_date': ''}
+                                   'last_patch_date': '',
+                                   'last_day': 0}
             stats_author = stats[hgauthor]
             for bugid in bugids:
                 if bugid not in buginfo:
@@ -232,8 +544,12 @@ def get_stats(hgpath, data_path, jsons, useless=set()):
         update_last_date(old, patches)
         jsons[data_path] = old
 
-        return True, old, bi['info'], patches
-    return False, old, None, None
+        # a repository starting at its tip has no processed changeset
+        # but its last revision must be saved
+        return max(count, 1), old, bi['info'], patches, backouts
+
+    jsons[data_path] = old
+    return 0, old, None, None, None
 
 
 def get_config(path='./config.json'):
@@ -243,41 +559,166 @@ def get_config(path='./config.json'):
     return conf
 
 
-def update():
+def run(conf, jsons, full=False, limit=None):
+    # update the data with the new changesets (at most limit ones)
+    # and push the diffs: the new data are in jsons. Return the number
+    # of processed changesets (with the backouts and the ones without bug)
+    paths = conf['paths']
+    useless = conf['useless_authors']
+    pathfilter.set_patterns(conf.get('exclude', pathfilter.DEFAULT_EXCLUDE))
+    changed, stats, buginfo, patches, backouts = \
+        get_stats(paths['hg'], paths['authors_data'], jsons,
+                  useless=useless, limit=limit)
+    if changed:
+        if full:
+            authors = None
+        else:
+            authors = set(p['author'] for p in patches)
+        mapping = update_mapping(stats, paths['mapping'],
+                                 conf['post'], jsons,
+                                 full_mapping_path=paths['full_mapping'],
+                                 authors=authors)
+        update_file_stats(patches, buginfo, mapping,
+                          paths['files_stats'], conf['post'], jsons,
+                          workers=conf.get('workers'),
+                          backouts=backouts,
+                          landed_path=paths.get('landed'),
+                          purge=full)
+        if paths.get('files_lines'):
+            update_files_lines(patches, paths['files_lines'],
+                               conf['post'], jsons,
+                               conf.get('large_file_lines', 5000))
+        with profiling.stage('update_review_load'):
+            update_review_load(buginfo, paths['review_load'],
+                               conf['post'], jsons)
+        with profiling.stage('update_components'):
+            update_components(patches, buginfo, mapping,
+                              paths['components'], conf['post'], jsons)
+    return changed
+
+
+def save(conf, jsons):
+    paths = conf['paths']
+    for path, data in jsons.items():
+        # a crash while writing mustn't leave a truncated file
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as Out:
+            json.dump(data, Out)
+        os.rename(tmp, path)
+    if paths.get('snapshot') and paths['files_stats'] in jsons:
+        with profiling.stage('export_snapshot'):
+            snapshot.write(paths['snapshot'],
+                           jsons[paths['files_stats']],
+                           jsons[paths['mapping']])
+
+
+def send_error(conf, files=[]):
+    date = lmdutils.get_today()
+    title = 'Error in getting data for Mozilla reviewers the {}'
+    title = title.format(date)
+    body = 'The data for reviewers have not been updated due to an error.'
+    gmail.send(conf['emails'], title, body, files=files)
+
+
+def update(profile=False, full=False):
     conf = get_config()
     paths = conf['paths']
     jsons = {}
+    status = 'error'
     logging.basicConfig(filename=paths['log'],
                         filemode='w',
                         level=logging.DEBUG,
                         format='%(asctime)s -- %(levelname)s -- %(message)s')
 
+    if profile:
+        profiling.start(paths['report'], paths.get('pstats'))
+
     try:
-        useless = conf['useless_authors']
-        changed, stats, buginfo, patches = get_stats(paths['hg'],
-                                                     paths['authors_data'],
-                                                     jsons,
-                                                     useless=useless)
+        changed = run(conf, jsons, full=full)
         if changed:
-            mapping = update_mapping(stats, paths['mapping'],
-                                     conf['post'], jsons)
-            update_file_stats(patches, buginfo, mapping,
-                              paths['files_stats'], conf['post'], jsons)
-            for path, data in jsons.items():
-                with open(path, 'w') as Out:
-                    json.dump(data, Out)
+            save(conf, jsons)
+        status = 'updated' if changed else 'unchanged'
     except:
         logging.error('An exception raised:', exc_info=True)
-        date = lmdutils.get_today()
-        title = 'Error in getting data for Mozilla reviewers the {}'
-        title = title.format(date)
-        body = 'The data for reviewers have not been updated due to an error.'
-        gmail.send(conf['emails'], title, body, files=[paths['log']])
+        send_error(conf, files=[paths['log']])
     finally:
+        profiling.stop(status)
         logging.shutdown()
         logging.getLogger(None).handlers = []
         os.remove(paths['log'])
 
 
+# set on SIGTERM: the daemon stops once the current run is finished
+_stop = {'requested': False}
+
+
+def stop_daemon(signum, frame):
+    _stop['requested'] = True
+
+
+def wait(seconds):
+    # sleep but wake up soon after a stop request
+    end = time.time() + seconds
+    while not _stop['requested'] and time.time() < end:
+        time.sleep(min(1, end - time.time()))
+
+
+def daemon(profile=False, interval=None, batch=None, save_interval=None):
+    # the new changesets are pulled every interval seconds and processed
+    # by batches: the data stay in memory and are saved every
+    # save_interval seconds. The pushed diffs contain the new values,
+    # so after a crash the changesets since the last save are just
+    # processed again.
+    conf = get_config()
+    paths = conf['paths']
+    options = conf.get('daemon', {})
+    interval = interval or options.get('interval', 300)
+    batch = batch or options.get('batch', 200)
+    save_interval = save_interval or options.get('save_interval', 3600)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s -- %(levelname)s -- %(message)s')
+    signal.signal(signal.SIGTERM, stop_daemon)
+
+    jsons = {}
+    dirty = False
+    failing = False
+    status = 'unchanged'
+    last_save = time.time()
+    try:
+        while not _stop['requested']:
+            if profile:
+                profiling.start(paths['report'], paths.get('pstats'))
+            status = 'error'
+            changed = 0
+            try:
+                changed = run(conf, jsons, limit=batch)
+                dirty = dirty or bool(changed)
+                if dirty and time.time() - last_save >= save_interval:
+                    save(conf, jsons)
+                    dirty = False
+                    last_save = time.time()
+                status = 'updated' if changed else 'unchanged'
+                failing = False
+            except Exception:
+                logging.error('An exception raised:', exc_info=True)
+                # the data are reloaded from the last saved files
+                jsons = {}
+                dirty = False
+                if not failing:
+                    failing = True
+                    send_error(conf)
+            finally:
+                profiling.stop(status)
+
+            if changed < batch:
+                # nothing more to process for now
+                wait(interval)
+    except KeyboardInterrupt:
+        # an interrupted run may have changed a part of the data
+        dirty = dirty and status != 'error'
+    if dirty:
+        save(conf, jsons)
+
+
 if __name__ == '__main__':
     update()
@@ -0,0 +1,254 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+import logging
+from multiprocessing import Pool, cpu_count
+import zlib
+
+
+AUTHOR_SCORE = 0.6
+REVIEWER_SCORE = 0.4
+# a changeset is rarely backed out after a few weeks
+BACKOUT_DAYS = 30
+EPSILON = 1e-9
+
+
+def get_contributions(patches, buginfo, mapping):
+    # keep only what is needed to score the files of a patch
+    res = []
+    for patch in patches:
+        bugid = patch['bugid']
+        if bugid not in buginfo or patch['author'] not in mapping:
+            # an ignored author or one without Bugzilla account
+            continue
+
+        files = patch['files']
+        res.append({'node': patch.get('node', ''),
+                    'date': patch['date'],
+                    'author': mapping[patch['author']],
+                    'reviewers': buginfo[bugid]['reviewers'],
+                    'touched': list(files['touched']),
+                    'added': list(files['added']),
+                    'moved': dict(files['moved'])})
+    return res
+
+
+def get_landing(contrib):
+    files = contrib['touched'] + contrib['added']
+    files += list(contrib['moved'].values())
+    return {'author': contrib['author'],
+            'reviewers': contrib['reviewers'],
+            'files': files,
+            'sign': contrib.get('sign', 1)}
+
+
+def index_contributions(landed, contributions):
+    # landed: short node => {'date': ..., 'contributions': [...]} with
+    # what the changeset added to the scores of the files
+    for contrib in contributions:
+        node = contrib.get('node')
+        if not node:
+            continue
+        node = node[:12]
+        if node not in landed:
+            landed[node] = {'date': contrib['date'],
+                            'contributions': []}
+        landed[node]['contributions'].append(get_landing(contrib))
+
+
+def get_reversals(landed, backouts):
+    # the contributions cancelling the backed out changesets: a backout
+    # is indexed too since it can be backed out itself
+    res = []
+    for backout in backouts:
+        reversals = []
+        for node in backout['backed_out']:
+            landing = landed.pop(node, None)
+            if landing is None:
+                continue
+            for contrib in landing['contributions']:
+                reversals.append({'node': backout['node'],
+                                  'date': backout['date'],
+                                  'author': contrib['author'],
+                                  'reviewers': contrib['reviewers'],
+                                  'touched': list(contrib['files']),
+                                  'added': [],
+                                  'moved': {},
+                                  'sign': -contrib['sign']})
+        index_contributions(landed, reversals)
+        res += reversals
+    return res
+
+
+def prune_landed(landed, days=BACKOUT_DAYS):
+    if not landed:
+        return
+    dates = [x['date'] for x in landed.values()]
+    last = datetime.strptime(max(dates), '%Y-%m-%d')
+    limit = (last - timedelta(days=days)).strftime('%Y-%m-%d')
+    old = [node for node, x in landed.items() if x['date'] < limit]
+    for node in old:
+        del landed[node]
+
+
+def add_score(scores, person, score):
+    if person in scores:
+        score += scores[person]
+    if score > EPSILON:
+        scores[person] = score
+    else:
+        # a reversed contribution: 0 in the diff removes the score
+        scores.pop(person, None)
+
+
+def apply_contributions(old, contributions):
+    # old is modified in place and the returned diff contains
+    # the new scores for all the modified (file, person)
+    diff_files = defaultdict(lambda: set())
+    for contrib in contributions:
+        files = contrib['touched']
+        for f in files:
+            if f not in old:
+                old[f] = {}
+
+        files = files + contrib['added']
+        for f in contrib['added']:
+            old[f] = {}
+
+        for o, n in contrib['moved'].items():
+            files.append(n)
+            # the scores are copied: the two paths mustn't share the same dict
+            old[n] = dict(old[o]) if o in old else {}
+            diff_files[n] |= set(old[n].keys())
+
+        sign = contrib.get('sign', 1)
+        for f in files:
+            scores = old[f]
+            for reviewer in contrib['reviewers']:
+                diff_files[f].add(reviewer)
+                add_score(scores, reviewer, sign * REVIEWER_SCORE)
+
+            diff_files[f].add(contrib['author'])
+            add_score(scores, contrib['author'], sign * AUTHOR_SCORE)
+
+    diff = {}
+    for f, persons in diff_files.items():
+        scores = old[f]
+        diff[f] = {p: scores.get(p, 0) for p in persons}
+        if not scores:
+            del old[f]
+
+    return diff
+
+
+def get_roots(contributions):
+    # a file and all the paths it has been moved to must be in the same shard
+    # else the scores can't be copied, so put them in the same set
+    parent = {}
+
+    def find(x):
+        root = x
+        while root in parent:
+            root = parent[root]
+        while x != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for contrib in contributions:
+        for o, n in contrib['moved'].items():
+            ro, rn = find(o), find(n)
+            if ro != rn:
+                parent[rn] = ro
+
+    return find
+
+
+def get_shard(path, find, N):
+    root = find(path)
+    return zlib.crc32(root.encode('utf-8')) % N
+
+
+def split(contributions, N):
+    find = get_roots(contributions)
+    shards = [[] for _ in range(N)]
+    paths = [set() for _ in range(N)]
+    fields = ['touched', 'added']
+
+    for contrib in contributions:
+        parts = {}
+
+        def get_part(i):
+            if i not in parts:
+                parts[i] = {'author': contrib['author'],
+                            'reviewers': contrib['reviewers'],
+                            'touched': [],
+                            'added': [],
+                            'moved': {},
+                            'sign': contrib.get('sign', 1)}
+            return parts[i]
+
+        for field in fields:
+            for f in contrib[field]:
+                i = get_shard(f, find, N)
+                get_part(i)[field].append(f)
+                paths[i].add(f)
+
+        for o, n in contrib['moved'].items():
+            i = get_shard(n, find, N)
+            get_part(i)['moved'][o] = n
+            paths[i].add(o)
+            paths[i].add(n)
+
+        for i in sorted(parts.keys()):
+            shards[i].append(parts[i])
+
+    return shards, paths
+
+
+def apply_shard(old, contributions):
+    diff = apply_contributions(old, contributions)
+    return old, diff
+
+
+def __apply_shard_helper(args):
+    return apply_shard(*args)
+
+
+def update(old, contributions, workers=None):
+    if workers is None:
+        workers = cpu_count()
+        workers = workers - 1 if workers > 1 else workers
+
+    if workers <= 1 or len(contributions) < 2 * workers:
+        return apply_contributions(old, contributions)
+
+    shards, paths = split(contributions, workers)
+    args = []
+    for contribs, shard_paths in zip(shards, paths):
+        if contribs:
+            sub = {p: old[p] for p in shard_paths if p in old}
+            args.append((sub, contribs))
+
+    msg = 'Update file stats: {} shards, {} contributions'
+    logging.info(msg.format(len(args), len(contributions)))
+
+    pool = Pool(processes=workers)
+    try:
+        results = pool.map(__apply_shard_helper, args)
+    finally:
+        pool.close()
+        pool.join()
+
+    diff = {}
+    for sub, d in results:
+        old.update(sub)
+        diff.update(d)
+        # the files without any score left
+        for f in d:
+            if f not in sub:
+                old.pop(f, None)
+
+    return diff
@@ -3,7 +3,11 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import defaultdict
+from datetime import datetime, timedelta
 import hglib
+import json
+from multiprocessing.pool import ThreadPool
+import os
 import re
 
 from .patch_analysis import get_files
@@ -26,6 +30,8 @@ BACKOUT_PAT = re.compile(r'(?:(?:back(?:ed|ing|s)?(?:[ _]*out[_]?))'
                          r'|(?:revert(?:ing|s)?)) '
                          r'(?:(?:cset|changeset|revision|rev|of)s?)?'
                          r'(.+)', re.I | re.DOTALL)
+NODE_PAT = re.compile(r'\b([0-9a-f]{12,40})\b')
+REVIEWERS_PAT = re.compile(r'\br[=:]([\w\-\.!,]+)', re.I | re.UNICODE)
 
 
 def get_bug_from(desc):
@@ -54,24 +60,56 @@ def get_bug_from(desc):
     return main
 
 
-def get_hg_info(hgpath, last_rev, rev='tip'):
+def get_backed_out(desc):
+    # the short nodes of the changesets backed out by desc (if any)
+    m = BACKOUT_PAT.search(desc)
+    if not m:
+        return []
+    nodes = []
+    for node in NODE_PAT.findall(m.group(1)):
+        node = node[:12]
+        if node not in nodes:
+            nodes.append(node)
+    return nodes
+
+
+def get_reviewers_from(desc):
+    # the nicks in the r=... of a commit message
+    reviewers = []
+    for m in REVIEWERS_PAT.finditer(desc):
+        for nick in m.group(1).split(','):
+            nick = nick.strip('.!')
+            if nick and nick not in reviewers:
+                reviewers.append(nick)
+    return reviewers
+
+
+def get_hg_info(hgpath, last_rev, rev='tip', limit=None):
+    # with a limit, only the oldest new changesets are retrieved
     client = hglib.open(hgpath)
     client.pull(update=True)
-    revrange = '{}:{}'.format(rev, last_rev)
-    out = client.log(revrange=revrange, nomerges=True)
-    last_rev, res, bugids, patches = None, None, None, None
+    if limit:
+        revrange = '{}:{}'.format(last_rev, rev)
+        out = client.log(revrange=revrange, nomerges=True, limit=limit + 1)
+        out = out[::-1]
+    else:
+        revrange = '{}:{}'.format(rev, last_rev)
+        out = client.log(revrange=revrange, nomerges=True)
+    last_rev, res, bugids, patches, backouts = None, None, None, None, None
 
     # remove the last entry which corresponds to last_rev
     out = out[:-1]
+    count = len(out)
     if out:
         last_rev = out[0][1]
         last_rev = last_rev.decode('ascii')
         res = defaultdict(lambda: set())
         patches = []
+        backouts = []
         bugids = set()
-        for o in out[:-1]:
+        for o in out:
             # rev, node, tags, branch, author, desc, date
-            rev, _, _, _, author, desc, date = o
+            rev, node, _, _, author, desc, date = o
             desc = desc.decode('utf-8')
             author = author.decode('utf-8')
             bugid = get_bug_from(desc)
@@ -80,11 +118,156 @@ def get_hg_info(hgpath, last_rev, rev='tip'):
                 bugids.add(bugid)
                 patch = client.export([rev], git=True)
                 patch = patch.decode('utf-8')
-                patches.append({'author': author,
+                patches.append({'node': node.decode('ascii'),
+                                'repo': hgpath,
+                                'author': author,
                                 'date': date.strftime('%Y-%m-%d'),
                                 'files': get_files(patch),
                                 'bugid': bugid})
+            else:
+                backed_out = get_backed_out(desc)
+                if backed_out:
+                    backouts.append({'node': node.decode('ascii'),
+                                     'date': date.strftime('%Y-%m-%d'),
+                                     'backed_out': backed_out})
         patches = patches[::-1]
+        backouts = backouts[::-1]
+
+    client.close()
+    # count includes the backouts and the changesets without bug
+    return last_rev, res, bugids, patches, backouts, count
 
+
+def get_tip(hgpath):
+    client = hglib.open(hgpath)
+    client.pull(update=True)
+    tip = client.tip().node.decode('ascii')
+    client.close()
+    return tip
+
+
+def get_known(hgpath, last_rev, candidates, chunk_size=500):
+    # the candidates already collected in hgpath (i.e. ancestors of last_rev)
+    known = set()
+    client = hglib.open(hgpath)
+    for i in range(0, len(candidates), chunk_size):
+        chunk = candidates[i:(i + chunk_size)]
+        revset = '({}) and ::{}'.format(
+            ' + '.join('id({})'.format(node) for node in chunk), last_rev)
+        for o in client.log(revrange=revset):
+            known.add(o[1].decode('ascii'))
     client.close()
-    return last_rev, res, bugids, patches
+    return known
+
+
+def get_repos_info(hgpaths, last_revs, nodes, rev='tip', limit=None):
+    # the repositories are pulled concurrently and a changeset which is in
+    # several of them (e.g. autoland and mozilla-central) is only counted
+    # once: nodes contains the ones seen recently (node => date) and the
+    # older ones are looked for in the other repositories.
+    # count is the largest number of new changesets in a repository
+    collected = [hgpath for hgpath in hgpaths if hgpath in last_revs]
+
+    def helper(hgpath):
+        if collected and hgpath not in last_revs:
+            # a repository added to the collected ones: its history is
+            # shared with them, so it starts at its tip
+            return get_tip(hgpath), None, None, [], [], 0
+        return get_hg_info(hgpath, last_revs.get(hgpath, '0'),
+                           rev=rev, limit=limit)
+
+    pool = ThreadPool(len(hgpaths))
+    try:
+        results = pool.map(helper, hgpaths)
+    finally:
+        pool.close()
+        pool.join()
+
+    new_revs = {}
+    res = defaultdict(lambda: set())
+    bugids = set()
+    patches = []
+    backouts = []
+    count = 0
+    for hgpath, result in zip(hgpaths, results):
+        last_rev, _, _, repo_patches, repo_backouts, repo_count = result
+        if not last_rev:
+            continue
+        new_revs[hgpath] = last_rev
+        count = max(count, repo_count)
+        others = [p for p in collected if p != hgpath]
+        if others:
+            candidates = [x['node'] for x in repo_backouts + repo_patches
+                          if x['node'] not in nodes]
+            for other in others:
+                known = get_known(other, last_revs[other], candidates)
+                candidates = [node for node in candidates
+                              if node not in known]
+            candidates = set(candidates)
+            repo_backouts = [x for x in repo_backouts
+                             if x['node'] in candidates]
+            repo_patches = [x for x in repo_patches
+                            if x['node'] in candidates]
+        for backout in repo_backouts:
+            node = backout['node']
+            if node in nodes:
+                continue
+            nodes[node] = backout['date']
+            backouts.append(backout)
+        for patch in repo_patches:
+            node = patch['node']
+            if node in nodes:
+                continue
+            nodes[node] = patch['date']
+            res[patch['author']].add(patch['bugid'])
+            bugids.add(patch['bugid'])
+            patches.append(patch)
+
+    return new_revs, res, bugids, patches, backouts, count
+
+
+def prune_nodes(nodes, days=92):
+    # a changeset lands in the other repositories within a few days
+    if not nodes:
+        return
+    last = datetime.strptime(max(nodes.values()), '%Y-%m-%d')
+    limit = (last - timedelta(days=days)).strftime('%Y-%m-%d')
+    old = [node for node, date in nodes.items() if date < limit]
+    for node in old:
+        del nodes[node]
+
+
+def count_lines(path):
+    with open(path, 'rb') as In:
+        return sum(1 for _ in In)
+
+
+def get_lines_histograms(hgpath, files, min_lines, chunk_size=50):
+    # for the files with at least min_lines lines, the number of lines
+    # last modified by each author (an empty dict for the other files)
+    res = {}
+    large = []
+    for f in files:
+        path = os.path.join(hgpath, f)
+        if os.path.isfile(path) and count_lines(path) >= min_lines:
+            large.append(f)
+        else:
+            res[f] = {}
+
+    client = hglib.open(hgpath)
+    for i in range(0, len(large), chunk_size):
+        chunk = large[i:(i + chunk_size)]
+        args = [b'annotate', b'-T', b'json', b'-u', b'-r', b'tip', b'--']
+        args += [os.path.join(hgpath, f).encode('utf-8') for f in chunk]
+        out = client.rawcommand(args)
+        for f in chunk:
+            res[f] = {}
+        for info in json.loads(out.decode('utf-8')):
+            # no lines for a binary file
+            histo = res[info['path']]
+            for line in info.get('lines', []):
+                author = line['user']
+                histo[author] = histo.get(author, 0) + 1
+    client.close()
+
+    return res
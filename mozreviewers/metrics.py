@@ -0,0 +1,81 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+import os
+from prometheus_client import (CollectorRegistry, Counter, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import time
+
+
+STATEMENTS = {'select', 'insert', 'update', 'delete', 'with'}
+
+REQUESTS = Histogram('mozreviewers_request_seconds',
+                     'Time spent to handle a request',
+                     ['endpoint', 'method'])
+STAGES = Histogram('mozreviewers_stage_seconds',
+                   'Time spent in each stage of a request',
+                   ['stage'])
+CACHE = Counter('mozreviewers_cache_total',
+                'Number of cache lookups',
+                ['cache', 'result'])
+OUTBOUND = Counter('mozreviewers_outbound_calls_total',
+                   'Number of calls to Bugzilla and hg.mozilla.org',
+                   ['upstream', 'result'])
+QUERIES = Counter('mozreviewers_db_queries_total',
+                  'Number of database queries',
+                  ['statement'])
+
+
+def get_multiproc_dir():
+    # gunicorn workers write their metrics in this directory
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR',
+                          os.environ.get('prometheus_multiproc_dir', ''))
+
+
+@contextmanager
+def timer(stage):
+    start = time.time()
+    try:
+        yield
+    finally:
+        STAGES.labels(stage).observe(time.time() - start)
+
+
+def observe_request(endpoint, method, duration):
+    REQUESTS.labels(endpoint or 'unknown', method).observe(duration)
+
+
+def cache_lookup(cache, hit):
+    CACHE.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def outbound_call(upstream, result):
+    OUTBOUND.labels(upstream, result).inc()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    toks = statement.split(None, 1)
+    statement = toks[0].lower() if toks else ''
+    if statement not in STATEMENTS:
+        statement = 'other'
+    QUERIES.labels(statement).inc()
+
+
+def export():
+    if get_multiproc_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def worker_exit(pid):
+    if get_multiproc_dir():
+        multiprocess.mark_process_dead(pid)
@@ -3,8 +3,31 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import six
+import sqlalchemy
 import sqlalchemy.dialects.postgresql as pg
-from .app import db, app
+from sqlalchemy import func
+from .app import db, app, get_engine_options
+from .logger import logger
+
+
+# session used to read the data (on the replica if any)
+_reader = {}
+
+
+def read_session():
+    if 'session' not in _reader:
+        uri = app.config['DATABASE_REPLICA_URL']
+        uri = uri or app.config['SQLALCHEMY_DATABASE_URI']
+        timeout = app.config['DB_STATEMENT_TIMEOUT']
+        options = get_engine_options(uri, timeout=timeout)
+        engine = sqlalchemy.create_engine(uri, **options)
+        _reader['session'] = db.create_scoped_session(options={'bind': engine})
+    return _reader['session']
+
+
+def remove_read_session():
+    if 'session' in _reader:
+        _reader['session'].remove()
 
 
 class Authors(db.Model):
@@ -50,12 +73,15 @@ class Authors(db.Model):
             db.session.expire_all()
             db.session.commit()
 
+        Generation.bump()
+        db.session.commit()
+
         return {'error': ''}
 
     @staticmethod
     def get(hgnames=[]):
         if not hgnames:
-            persons = db.session.query(Authors).all()
+            persons = read_session().query(Authors).all()
             res = {p.hgname: p.bzname for p in persons}
             return {'bznames': res,
                     'error': ''}
@@ -76,29 +102,105 @@ class Authors(db.Model):
                 return {'bznames': {},
                         'error': 'Strings expected'}
 
-        persons = db.session.query(Authors)
+        persons = read_session().query(Authors)
         persons = persons.filter(Authors.hgname.in_(hgnames)).all()
         res = {p.hgname: p.bzname for p in persons}
         return {'bznames': res,
                 'error': ''}
 
 
+def chunks(data, chunk_size):
+    # as libmozdata.connection.Connection.chunks, which is slow to import
+    for i in range(0, len(data), chunk_size):
+        yield data[i:(i + chunk_size)]
+
+
+class Files(db.Model):
+    __tablename__ = 'files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(512), nullable=False, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        s = '<File id: {}, name: {}>'
+        return s.format(self.id,
+                        self.name)
+
+
+class People(db.Model):
+    __tablename__ = 'people'
+
+    # bz authors
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(256), nullable=False, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        s = '<Person id: {}, name: {}>'
+        return s.format(self.id,
+                        self.name)
+
+
+def get_ids(model, names, cmd):
+    # get the ids of the names in Files or People and create the missing ones
+    names = list(set(names))
+    ids = {}
+    for chunk in chunks(names, 1000):
+        query = db.session.query(model.id, model.name)
+        for i, name in query.filter(model.name.in_(chunk)):
+            ids[name] = i
+
+    missing = [n for n in names if n not in ids]
+    if missing:
+        if cmd == 'create':
+            objs = [model(n) for n in missing]
+            db.session.add_all(objs)
+            db.session.flush()
+            for obj in objs:
+                ids[obj.name] = obj.id
+        else:
+            for chunk in chunks(missing, 1000):
+                ins = pg.insert(model).values([{'name': n} for n in chunk])
+                ins = ins.on_conflict_do_nothing(index_elements=['name'])
+                ins = ins.returning(model.id, model.name)
+                for i, name in db.session.execute(ins):
+                    ids[name] = i
+            # the ones inserted by a concurrent transaction
+            missing = [n for n in missing if n not in ids]
+            for chunk in chunks(missing, 1000):
+                query = db.session.query(model.id, model.name)
+                for i, name in query.filter(model.name.in_(chunk)):
+                    ids[name] = i
+    return ids
+
+
 class FilesStats(db.Model):
-    __tablename__ = 'filesstats'
+    __tablename__ = 'filesscores'
 
-    filename = db.Column(db.String(512), primary_key=True)
-    author = db.Column(db.String(256), primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'),
+                        primary_key=True)
+    person_id = db.Column(db.Integer, db.ForeignKey('people.id'),
+                          primary_key=True)
     score = db.Column(db.Float)
 
-    def __init__(self, filename, author, score):
-        self.filename = filename
-        self.author = author
+    # the lookups by file only read the index
+    __table_args__ = (db.Index('ix_filesscores_covering',
+                               'file_id', 'person_id', 'score'),)
+
+    def __init__(self, file_id, person_id, score):
+        self.file_id = file_id
+        self.person_id = person_id
         self.score = score
 
     def __repr__(self):
-        s = '<FileStat filename: {}, author: {}, score: {}>'
-        return s.format(self.filename,
-                        self.author,
+        s = '<FileStat file: {}, person: {}, score: {}>'
+        return s.format(self.file_id,
+                        self.person_id,
                         self.score)
 
     @staticmethod
@@ -107,18 +209,39 @@ class FilesStats(db.Model):
         #                  'data': filename => {author => score}}
         cmd = data['command']
         data = data['data']
+        persons = set(p for scores in data.values() for p in scores.keys())
+        file_ids = get_ids(Files, data.keys(), cmd)
+        person_ids = get_ids(People, persons, cmd)
+
+        rows = []
+        torm = []
         for filename, scores in data.items():
+            file_id = file_ids[filename]
             for person, score in scores.items():
-                if cmd == 'create':
-                    db.session.add(FilesStats(filename, person, score))
-                else:
-                    ins = pg.insert(FilesStats).values(filename=filename,
-                                                       author=person,
-                                                       score=score)
-                    upd = ins.on_conflict_do_update(index_elements=['filename',
-                                                                    'author'],
-                                                    set_=dict(score=score))
-                    db.session.execute(upd)
+                if score <= 0:
+                    # the contributions have been backed out
+                    torm.append((file_id, person_ids[person]))
+                    continue
+                rows.append({'file_id': file_id,
+                             'person_id': person_ids[person],
+                             'score': score})
+
+        for chunk in chunks(torm, 1000):
+            keys = db.tuple_(FilesStats.file_id, FilesStats.person_id)
+            q = db.session.query(FilesStats).filter(keys.in_(chunk))
+            q.delete(synchronize_session=False)
+
+        for chunk in chunks(rows, 1000):
+            if cmd == 'create':
+                db.session.bulk_insert_mappings(FilesStats, chunk)
+            else:
+                ins = pg.insert(FilesStats).values(chunk)
+                keys = ['file_id', 'person_id']
+                score = ins.excluded.score
+                upd = ins.on_conflict_do_update(index_elements=keys,
+                                                set_=dict(score=score))
+                db.session.execute(upd)
+        Generation.bump()
         db.session.commit()
         return {'error': ''}
 
@@ -145,21 +268,393 @@ class FilesStats(db.Model):
                 return {'stats': {},
                         'error': 'Strings expected'}
 
-        files = db.session.query(FilesStats)
-        files = files.filter(FilesStats.filename.in_(filenames)).all()
+        query = read_session().query(Files.name, People.name, FilesStats.score)
+        query = query.join(FilesStats, FilesStats.file_id == Files.id)
+        query = query.join(People, People.id == FilesStats.person_id)
+        files = query.filter(Files.name.in_(filenames)).all()
         res = {}
-        for f in files:
-            name = f.filename
+        for name, author, score in files:
             if name not in res:
                 res[name] = {}
-            res[name][f.author] = f.score
+            res[name][author] = score
 
         return {'stats': res,
                 'error': ''}
 
+    @staticmethod
+    def gather(filenames, number=None):
+        # same as reviewers.gather but computed by the database:
+        # the scores are summed per person and divided by the total
+        # (computed before removing the inactive people), and only the
+        # active people (the ones in Authors) are kept
+        if not filenames:
+            return {'stats': {},
+                    'error': ''}
 
-def create():
+        session = read_session()
+        score = func.sum(FilesStats.score)
+        sums = session.query(FilesStats.person_id.label('person_id'),
+                             score.label('score'),
+                             func.sum(score).over().label('total'))
+        sums = sums.join(Files, Files.id == FilesStats.file_id)
+        sums = sums.filter(Files.name.in_(filenames))
+        sums = sums.group_by(FilesStats.person_id).subquery()
+
+        active = session.query(Authors.bzname)
+        query = session.query(People.name, sums.c.score / sums.c.total)
+        query = query.join(sums, sums.c.person_id == People.id)
+        query = query.filter(People.name.in_(active))
+        query = query.order_by(sums.c.score.desc(), People.name)
+        if number:
+            query = query.limit(number)
+
+        res = {name: score for name, score in query}
+        return {'stats': res,
+                'error': ''}
+
+
+def use_sql_aggregation():
+    mode = app.config['SQL_AGGREGATION'].lower()
+    if mode == 'auto':
+        uri = app.config['DATABASE_REPLICA_URL']
+        uri = uri or app.config['SQLALCHEMY_DATABASE_URI'] or ''
+        return uri.startswith('postgres')
+    return mode == 'true'
+
+
+# the old denormalized table: only used to migrate its data
+legacy_filesstats = sqlalchemy.Table(
+    'filesstats', sqlalchemy.MetaData(),
+    sqlalchemy.Column('filename', sqlalchemy.String(512), primary_key=True),
+    sqlalchemy.Column('author', sqlalchemy.String(256), primary_key=True),
+    sqlalchemy.Column('score', sqlalchemy.Float))
+
+
+def migrate_filesstats(batch=10000, drop=False):
+    # copy the old table in the new ones by small batches (each one in its
+    # own transaction), so the service can run during the migration.
+    # Nothing writes the old table anymore: a score already pushed in the
+    # new ones by the collector is more recent, so it's kept.
+    create()
+    if not has_table('filesstats'):
+        return 0
+
+    t = legacy_filesstats
+    key = sqlalchemy.tuple_(t.c.filename, t.c.author)
+    last = None
+    total = 0
+    while True:
+        query = sqlalchemy.select([t.c.filename, t.c.author, t.c.score])
+        if last is not None:
+            query = query.where(key > sqlalchemy.tuple_(*last))
+        query = query.order_by(t.c.filename, t.c.author).limit(batch)
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            break
+
+        file_ids = get_ids(Files, [r[0] for r in rows], 'update')
+        person_ids = get_ids(People, [r[1] for r in rows], 'update')
+        values = [{'file_id': file_ids[filename],
+                   'person_id': person_ids[author],
+                   'score': score}
+                  for filename, author, score in rows if score > 0]
+        if values:
+            ins = pg.insert(FilesStats).values(values)
+            ins = ins.on_conflict_do_nothing(index_elements=['file_id',
+                                                             'person_id'])
+            db.session.execute(ins)
+        db.session.commit()
+        last = (rows[-1][0], rows[-1][1])
+        total += len(rows)
+        logger.info('Migrate filesstats: {} rows copied'.format(total))
+
+    # the cached responses were computed on partial data
+    Generation.bump()
+    db.session.commit()
+    if drop:
+        t.drop(db.get_engine(app))
+
+    return total
+
+
+class FilesLines(db.Model):
+    __tablename__ = 'fileslines'
+
+    # number of lines of a large file last modified by an hg author
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'),
+                        primary_key=True)
+    hgname = db.Column(db.String(512), primary_key=True)
+    lines = db.Column(db.Integer)
+
+    def __init__(self, file_id, hgname, lines):
+        self.file_id = file_id
+        self.hgname = hgname
+        self.lines = lines
+
+    def __repr__(self):
+        s = '<FileLines file: {}, author: {}, lines: {}>'
+        return s.format(self.file_id,
+                        self.hgname,
+                        self.lines)
+
+    @staticmethod
+    def post(data):
+        # data is a dict: {'command': 'update' or 'create',
+        #                  'data': filename => {hgname => lines}}
+        # the histogram of a file replaces the previous one
+        cmd = data['command']
+        data = data['data']
+        file_ids = get_ids(Files, data.keys(), cmd)
+
+        if cmd != 'create':
+            ids = list(file_ids.values())
+            for chunk in chunks(ids, 1000):
+                query = db.session.query(FilesLines)
+                query = query.filter(FilesLines.file_id.in_(chunk))
+                query.delete(synchronize_session=False)
+
+        rows = []
+        for filename, histo in data.items():
+            file_id = file_ids[filename]
+            for hgname, lines in histo.items():
+                rows.append({'file_id': file_id,
+                             'hgname': hgname,
+                             'lines': lines})
+        for chunk in chunks(rows, 1000):
+            db.session.bulk_insert_mappings(FilesLines, chunk)
+        Generation.bump()
+        db.session.commit()
+        return {'error': ''}
+
+    @staticmethod
+    def get(filenames):
+        if not filenames:
+            return {'lines': {},
+                    'error': 'No filenames specified'}
+
+        query = read_session().query(Files.name, FilesLines.hgname,
+                                     FilesLines.lines)
+        query = query.join(FilesLines, FilesLines.file_id == Files.id)
+        res = {}
+        for chunk in chunks(list(filenames), 1000):
+            for name, hgname, lines in query.filter(Files.name.in_(chunk)):
+                if name not in res:
+                    res[name] = {}
+                res[name][hgname] = lines
+
+        return {'lines': res,
+                'error': ''}
+
+
+class ReviewLoad(db.Model):
+    __tablename__ = 'reviewload'
+
+    # number of open review requests for a bz author
+    bzname = db.Column(db.String(256), primary_key=True)
+    count = db.Column(db.Integer)
+
+    def __init__(self, bzname, count):
+        self.bzname = bzname
+        self.count = count
+
+    def __repr__(self):
+        s = '<ReviewLoad bz: {}, count: {}>'
+        return s.format(self.bzname,
+                        self.count)
+
+    @staticmethod
+    def post(data):
+        # data is a dict: {'command': 'update' or 'create',
+        #                  'data': bzname => count}
+        cmd = data['command']
+        data = data['data']
+        torm = []
+        for bzname, count in data.items():
+            if count <= 0:
+                torm.append(bzname)
+            elif cmd == 'create':
+                db.session.add(ReviewLoad(bzname, count))
+            else:
+                ins = pg.insert(ReviewLoad).values(bzname=bzname,
+                                                   count=count)
+                upd = ins.on_conflict_do_update(index_elements=['bzname'],
+                                                set_=dict(count=count))
+                db.session.execute(upd)
+
+        if torm:
+            query = db.session.query(ReviewLoad)
+            persons = query.filter(ReviewLoad.bzname.in_(torm))
+            persons.delete(synchronize_session=False)
+            db.session.expire_all()
+        db.session.commit()
+
+        return {'error': ''}
+
+    @staticmethod
+    def get():
+        persons = read_session().query(ReviewLoad).all()
+        res = {p.bzname: p.count for p in persons}
+        return {'load': res,
+                'error': ''}
+
+
+class ComponentsStats(db.Model):
+    __tablename__ = 'componentsstats'
+
+    product = db.Column(db.String(256), primary_key=True)
+    component = db.Column(db.String(256), primary_key=True)
+    author = db.Column(db.String(256), primary_key=True)
+    score = db.Column(db.Float)
+
+    def __init__(self, product, component, author, score):
+        self.product = product
+        self.component = component
+        self.author = author
+        self.score = score
+
+    def __repr__(self):
+        s = '<ComponentStat product: {}, component: {}, '\
+            'author: {}, score: {}>'
+        return s.format(self.product,
+                        self.component,
+                        self.author,
+                        self.score)
+
+    @staticmethod
+    def post(data):
+        # data is a dict: {'command': 'update' or 'create',
+        #                  'data': {'scores': pc => {'product': ...,
+        #                                            'component': ...,
+        #                                            'scores': {...}},
+        #                           'bugs': bugid => {'product': ...,
+        #                                             'component': ...}}}
+        # where pc is 'product::component' and scores is author => score
+        cmd = data['command']
+        data = data['data']
+        for info in data['scores'].values():
+            product = info['product']
+            component = info['component']
+            for person, score in info['scores'].items():
+                if cmd == 'create':
+                    db.session.add(ComponentsStats(product, component,
+                                                   person, score))
+                else:
+                    ins = pg.insert(ComponentsStats)
+                    ins = ins.values(product=product,
+                                     component=component,
+                                     author=person,
+                                     score=score)
+                    keys = ['product', 'component', 'author']
+                    upd = ins.on_conflict_do_update(index_elements=keys,
+                                                    set_=dict(score=score))
+                    db.session.execute(upd)
+
+        for bugid, info in data['bugs'].items():
+            product = info['product']
+            component = info['component']
+            if cmd == 'create':
+                db.session.add(Bugs(int(bugid), product, component))
+            else:
+                ins = pg.insert(Bugs).values(bugid=int(bugid),
+                                             product=product,
+                                             component=component)
+                upd = ins.on_conflict_do_update(index_elements=['bugid'],
+                                                set_=dict(product=product,
+                                                          component=component))
+                db.session.execute(upd)
+
+        Generation.bump()
+        db.session.commit()
+        return {'error': ''}
+
+    @staticmethod
+    def get(product, component):
+        if not product or not component:
+            return {'stats': {},
+                    'error': 'A product and a component are expected'}
+
+        stats = read_session().query(ComponentsStats)
+        stats = stats.filter(ComponentsStats.product == product,
+                             ComponentsStats.component == component).all()
+        res = {s.author: s.score for s in stats}
+        return {'stats': res,
+                'error': ''}
+
+    @staticmethod
+    def get_for_bug(bugid):
+        try:
+            bugid = int(bugid)
+        except (TypeError, ValueError):
+            return {'stats': {},
+                    'error': 'Invalid bug id'}
+
+        bug = read_session().query(Bugs).get(bugid)
+        if bug is None:
+            return {'stats': {},
+                    'error': 'Unknown bug {}'.format(bugid)}
+        return ComponentsStats.get(bug.product, bug.component)
+
+
+class Bugs(db.Model):
+    __tablename__ = 'bugs'
+
+    # product and component of the bugs seen in the pushes
+    bugid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product = db.Column(db.String(256))
+    component = db.Column(db.String(256))
+
+    def __init__(self, bugid, product, component):
+        self.bugid = bugid
+        self.product = product
+        self.component = component
+
+    def __repr__(self):
+        s = '<Bug id: {}, product: {}, component: {}>'
+        return s.format(self.bugid,
+                        self.product,
+                        self.component)
+
+
+class Generation(db.Model):
+    __tablename__ = 'generation'
+
+    # bumped each time the scores or the authors change:
+    # the cached responses of an older generation are stale
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    number = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, number):
+        self.id = 1
+        self.number = number
+
+    def __repr__(self):
+        return '<Generation {}>'.format(self.number)
+
+    @staticmethod
+    def bump():
+        # the caller commits
+        query = db.session.query(Generation).filter(Generation.id == 1)
+        n = query.update({Generation.number: Generation.number + 1},
+                         synchronize_session=False)
+        if not n:
+            db.session.add(Generation(1))
+
+    @staticmethod
+    def get():
+        query = read_session().query(Generation.number)
+        gen = query.filter(Generation.id == 1).scalar()
+        return {'generation': gen or 0,
+                'error': ''}
+
+
+def has_table(name):
     e = db.get_engine(app)
-    d = e.dialect
-    if not d.has_table(e, 'authors') or not d.has_table(e, 'filestats'):
-        db.create_all()
+    with e.connect() as conn:
+        return e.dialect.has_table(conn, name)
+
+
+def create():
+    for table in db.metadata.tables.keys():
+        if not has_table(table):
+            db.create_all()
+            break
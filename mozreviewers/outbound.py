@@ -0,0 +1,166 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# The calls to Bugzilla and hg.mozilla.org go through here: in a worker,
+# at most CONCURRENCY calls to an upstream are running, the identical
+# lookups in flight are made once, a caller waits at most TIMEOUT seconds
+# and after FAILURES failures in a row the upstream isn't called for
+# RESET seconds (then a single call is tried).
+
+import os
+import threading
+import time
+
+from . import metrics
+from .logger import logger
+
+
+def get_setting(name, key, default):
+    env = '{}_{}'.format(name.upper(), key)
+    return float(os.environ.get(env, os.environ.get('OUTBOUND_' + key,
+                                                    default)))
+
+
+class Unavailable(Exception):
+    # the circuit is open or the call took too much time
+
+    def __init__(self, name, reason):
+        msg = '{} is unavailable ({})'.format(name, reason)
+        super(Unavailable, self).__init__(msg)
+        self.name = name
+        self.reason = reason
+
+
+class Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.timed_out = False
+
+
+class Upstream(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.concurrency = int(get_setting(name, 'CONCURRENCY', 8))
+        self.timeout = get_setting(name, 'TIMEOUT', 20)
+        self.max_failures = int(get_setting(name, 'FAILURES', 5))
+        self.reset = get_setting(name, 'RESET', 30)
+        self.semaphore = threading.BoundedSemaphore(self.concurrency)
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+
+    def allow(self):
+        # self.lock must be held
+        if self.opened is None:
+            return True
+        if self.trial or time.time() - self.opened < self.reset:
+            return False
+        # half-open: this call tells if the upstream is back
+        self.trial = True
+        return True
+
+    def is_open(self):
+        with self.lock:
+            return self.opened is not None and \
+                time.time() - self.opened < self.reset
+
+    def success(self):
+        with self.lock:
+            if self.opened is not None:
+                logger.info('Circuit closed for {}'.format(self.name))
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.opened is not None or \
+               self.failures >= self.max_failures:
+                if self.opened is None:
+                    logger.warning('Circuit opened for {}'.format(self.name))
+                self.opened = time.time()
+            self.trial = False
+
+    def run(self, key, call, func, args, kwargs):
+        try:
+            with self.semaphore:
+                call.result = func(*args, **kwargs)
+            # a late answer doesn't close the circuit
+            if not call.timed_out:
+                self.success()
+        except Exception as e:
+            call.error = e
+            # the timeout has already been counted
+            if not call.timed_out:
+                self.failure()
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is call:
+                    del self.inflight[key]
+            call.done.set()
+
+
+_upstreams = {}
+_lock = threading.Lock()
+
+
+def get_upstream(name):
+    with _lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name)
+        return _upstreams[name]
+
+
+def is_open(name):
+    return get_upstream(name).is_open()
+
+
+def call(name, key, func, *args, **kwargs):
+    # key identifies the lookup (None to never share the result) and
+    # the calls are made in a thread, so the caller can stop waiting
+    timeout = kwargs.pop('timeout', -1)
+    upstream = get_upstream(name)
+    if timeout == -1:
+        timeout = upstream.timeout
+
+    with upstream.lock:
+        c = upstream.inflight.get(key) if key is not None else None
+        leader = c is None
+        if leader and upstream.allow():
+            c = Call()
+            if key is not None:
+                upstream.inflight[key] = c
+    if c is None:
+        metrics.outbound_call(name, 'open')
+        raise Unavailable(name, 'circuit open')
+
+    if leader:
+        t = threading.Thread(target=upstream.run,
+                             args=(key, c, func, args, kwargs))
+        t.daemon = True
+        t.start()
+    else:
+        metrics.outbound_call(name, 'coalesced')
+
+    if not c.done.wait(timeout):
+        with upstream.lock:
+            # the callers sharing the call count for one failure
+            first = not c.timed_out
+            c.timed_out = True
+        if first:
+            upstream.failure()
+        metrics.outbound_call(name, 'timeout')
+        raise Unavailable(name, 'timeout')
+    if c.error is not None:
+        metrics.outbound_call(name, 'error')
+        raise c.error
+    metrics.outbound_call(name, 'ok')
+    return c.result
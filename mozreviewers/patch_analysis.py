@@ -3,8 +3,14 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from collections import defaultdict
-import whatthepatch
-from libmozdata.hgmozilla import Annotate
+import os
+
+from . import metrics
+from . import outbound
+from .pathfilter import filter_patch_files, is_excluded
+
+
+MAX_ANNOTATED_FILES = int(os.environ.get('MAX_ANNOTATED_FILES', 50))
 
 
 def get_files(patch):
@@ -34,7 +40,7 @@ def get_files(patch):
                     files['moved'][old_p] = new_p
                 else:
                     files['touched'].append(old_p)
-    return files
+    return filter_patch_files(files)
 
 
 def analyze_annotations(info, annotations):
@@ -54,35 +60,88 @@ def analyze_annotations(info, annotations):
             'all': alllines}
 
 
-def analyze_patch(patch, check_annotations):
-    files = get_files(patch)
-    changed = set(files['touched']) | set(files['moved'].keys())
-
-    if check_annotations:
-        newed = set(files['added']) | set(files['deleted'])
+def analyze_histograms(info, histograms, stats):
+    # without the annotations, the authors of the removed lines are
+    # supposed to be distributed as the ones of the whole file
+    deleted = stats['deleted']
+    alllines = stats['all']
+    for path, histo in histograms.items():
+        total = float(sum(histo.values()))
+        removed = len(info[path])
+        for author, n in histo.items():
+            deleted[author] += removed * n / total
+            alllines[author] += n
+
+
+def get_annotations(files, degraded):
+    from libmozdata.hgmozilla import Annotate
+
+    key = ('annotate', tuple(sorted(files)))
+    try:
+        return outbound.call('hgmo', key, Annotate.get, files, node='tip')
+    except outbound.Unavailable:
+        # the removed lines aren't used
+        if degraded is not None:
+            degraded.add('hgmo')
+        return None
+
+
+def analyze_patch(patch, check_annotations, get_histograms=None,
+                  degraded=None):
+    # get_histograms returns the number of lines per author of the large
+    # files: when given, these files aren't annotated
+    # the unavailable upstreams are added in degraded
+    # only needed when the annotations are checked and hgdata only uses
+    # get_files, so it's imported here
+    import whatthepatch
+
+    with metrics.timer('parse'):
+        files = get_files(patch)
+        changed = set(files['touched']) | set(files['moved'].keys())
 
         info = defaultdict(lambda: [])
-        for diff in whatthepatch.parse_patch(patch):
-            h = diff.header
-            if not h:
-                continue
-
-            old_p = h.old_path
-            old_p = old_p[2:] if old_p.startswith('a/') else old_p
-            if old_p in newed:
-                # the file has just been added or deleted,
-                # so nothing to compute
-                continue
-
-            for old, new, _ in diff.changes:
-                if old is not None and new is None:
-                    # removed line
-                    info[old_p].append(old)
-
-        files = list(info.keys())
-        if files:
-            annotations = Annotate.get(files, node='tip')
-            stats = analyze_annotations(info, annotations)
-            return stats, changed
+        if check_annotations:
+            newed = set(files['added']) | set(files['deleted'])
+            for diff in whatthepatch.parse_patch(patch):
+                h = diff.header
+                if not h:
+                    continue
+
+                old_p = h.old_path
+                old_p = old_p[2:] if old_p.startswith('a/') else old_p
+                if old_p in newed or is_excluded(old_p):
+                    # the file has just been added or deleted,
+                    # or is excluded so nothing to compute
+                    continue
+
+                for old, new, _ in diff.changes:
+                    if old is not None and new is None:
+                        # removed line
+                        info[old_p].append(old)
+
+    files = list(info.keys())
+    if len(files) > MAX_ANNOTATED_FILES:
+        # the files with the most removed lines are the most informative
+        files = sorted(files, key=lambda f: (-len(info[f]), f))
+        files = files[:MAX_ANNOTATED_FILES]
+        info = {f: info[f] for f in files}
+    if files:
+        histograms = {}
+        if get_histograms is not None:
+            with metrics.timer('histograms'):
+                histograms = get_histograms(files)
+        exact = [f for f in files if f not in histograms]
+        annotations = {}
+        if exact:
+            with metrics.timer('annotate'):
+                annotations = get_annotations(exact, degraded)
+            if annotations is None:
+                annotations = {}
+                exact = []
+        with metrics.timer('scoring'):
+            stats = analyze_annotations({f: info[f] for f in exact},
+                                        annotations)
+            analyze_histograms(info, histograms, stats)
+        return stats, changed
 
     return {'deleted': {}, 'all': {}}, changed
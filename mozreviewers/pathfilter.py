@@ -0,0 +1,65 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# The vendored or generated files aren't scored: they would add a lot of
+# paths without telling anything about who knows the code.
+
+import fnmatch
+import os
+import re
+
+
+DEFAULT_EXCLUDE = ['third_party/*',
+                   '*/third_party/*',
+                   '*/vendor/*',
+                   '*.min.js']
+
+_matcher = {'matcher': None}
+
+
+def get_env_patterns():
+    patterns = os.environ.get('EXCLUDE_PATHS', ','.join(DEFAULT_EXCLUDE))
+    return [p.strip() for p in patterns.split(',') if p.strip()]
+
+
+def get_matcher(patterns):
+    # a '*' matches a '/' too
+    if not patterns:
+        return None
+    pat = '|'.join('(?:{})'.format(fnmatch.translate(p)) for p in patterns)
+    return re.compile(pat)
+
+
+def set_patterns(patterns):
+    _matcher['matcher'] = get_matcher(patterns)
+
+
+def is_excluded(path):
+    matcher = _matcher['matcher']
+    return matcher is not None and matcher.match(path) is not None
+
+
+def filter_files(files):
+    return [f for f in files if not is_excluded(f)]
+
+
+def filter_patch_files(files):
+    # files is a dict as returned by patch_analysis.get_files
+    added = filter_files(files['added'])
+    moved = {}
+    for o, n in files['moved'].items():
+        if is_excluded(n):
+            continue
+        if is_excluded(o):
+            # moved out of an excluded directory
+            added.append(n)
+        else:
+            moved[o] = n
+    return {'touched': filter_files(files['touched']),
+            'deleted': filter_files(files['deleted']),
+            'added': added,
+            'moved': moved}
+
+
+set_patterns(get_env_patterns())
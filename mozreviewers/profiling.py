@@ -0,0 +1,113 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import cProfile
+from contextlib import contextmanager
+import json
+import logging
+import os
+import resource
+import time
+
+
+# the current run: None when the profiling is disabled
+_run = {'report': None,
+        'pstats': None,
+        'start': 0.,
+        'stages': [],
+        'profilers': []}
+
+
+def get_maxrss():
+    # peak RSS in kB of this process and of its terminated children
+    me = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return me, children
+
+
+def is_enabled():
+    return _run['report'] is not None
+
+
+def start(report_path, pstats_dir=None):
+    _run['report'] = report_path
+    _run['pstats'] = pstats_dir
+    _run['start'] = time.time()
+    _run['date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    _run['stages'] = []
+    _run['profilers'] = []
+    if pstats_dir and not os.path.isdir(pstats_dir):
+        os.makedirs(pstats_dir)
+
+
+@contextmanager
+def stage(name):
+    # the caller can put some counts in the yielded dict
+    counts = {}
+    if not is_enabled():
+        yield counts
+        return
+
+    profiler = None
+    profilers = _run['profilers']
+    if _run['pstats']:
+        # only one profiler can be active, so the one of the enclosing
+        # stage is paused
+        if profilers:
+            profilers[-1].disable()
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    start_time = time.time()
+    start_rss, _ = get_maxrss()
+    try:
+        yield counts
+    finally:
+        duration = time.time() - start_time
+        rss, children = get_maxrss()
+        if profiler is not None:
+            profiler.disable()
+            profilers.pop()
+            if profilers:
+                profilers[-1].enable()
+            date = _run['date'].replace(':', '')
+            filename = '{}-{}-{}.pstats'.format(date,
+                                                len(_run['stages']),
+                                                name)
+            profiler.dump_stats(os.path.join(_run['pstats'], filename))
+
+        info = {'stage': name,
+                'time': duration,
+                'maxrss': rss,
+                'maxrss_increase': rss - start_rss,
+                'children_maxrss': children,
+                'counts': counts}
+        _run['stages'].append(info)
+        msg = 'Stage {}: {}s, maxrss={}kB, counts={}'
+        logging.info(msg.format(name, duration, rss, counts))
+
+
+def stop(status):
+    if not is_enabled():
+        return
+
+    report_path = _run['report']
+    runs = []
+    if os.path.isfile(report_path):
+        with open(report_path, 'r') as In:
+            runs = json.load(In)
+
+    rss, children = get_maxrss()
+    runs.append({'date': _run['date'],
+                 'status': status,
+                 'time': time.time() - _run['start'],
+                 'maxrss': rss,
+                 'children_maxrss': children,
+                 'stages': _run['stages']})
+    with open(report_path, 'w') as Out:
+        json.dump(runs, Out, indent=1)
+
+    _run['report'] = None
+    _run['pstats'] = None
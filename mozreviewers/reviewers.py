@@ -2,22 +2,57 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from collections import defaultdict
-from libmozdata.bugzilla import BugzillaUser
-from libmozdata.connection import Connection
+from collections import defaultdict, OrderedDict
+import copy
+import hashlib
 import math
+import os
 import re
 import six
+import threading
+import time
 
+from . import cache
+from . import metrics
+from . import outbound
+from . import snapshot
 from .patch_analysis import analyze_patch
-from .models import FilesStats, Authors
+from .pathfilter import filter_files
+from .models import FilesStats, FilesLines, Authors, ReviewLoad
+from .models import ComponentsStats
+from .models import use_sql_aggregation
 from .logger import logger
 
 
 NICK_PAT = re.compile(r'(:[\w]+)')
+LOAD_TTL = float(os.environ.get('REVIEW_LOAD_TTL', 300))
+LOAD_WEIGHT = float(os.environ.get('REVIEW_LOAD_WEIGHT', 0.5))
+NICKS_CACHE_SIZE = int(os.environ.get('NICKS_CACHE_SIZE', 4096))
+GATHER_CACHE_SIZE = int(os.environ.get('GATHER_CACHE_SIZE', 1024))
+RANKING_CACHE_SIZE = int(os.environ.get('RANKING_CACHE_SIZE', 1024))
+
+# bzname => number of open review requests, reloaded every LOAD_TTL seconds
+_load = {'counts': {},
+         'time': None}
+
+# the entries are keyed by the data generation, so they're not used
+# anymore once the scores or the authors have been updated:
+#  - the gathered scores of a set of files;
+#  - the /reviewers responses for a patch and an author.
+_gathered = cache.MemoryCache(GATHER_CACHE_SIZE)
+_rankings = cache.MemoryCache(RANKING_CACHE_SIZE)
+
+# bzname => the last info got from Bugzilla, used when it's unavailable
+_nicks = OrderedDict()
+_nicks_lock = threading.Lock()
+
+
+def fetch_nicks(authors):
+    # libmozdata is slow to import and the workers mustn't pay for it
+    # at boot
+    from libmozdata.bugzilla import BugzillaUser
+    from libmozdata.connection import Connection
 
-
-def get_nick(authors):
     bz = {}
 
     def user_handler(u):
@@ -40,8 +75,98 @@ def get_nick(authors):
     for q in queries:
         q.wait()
 
-    authors = [bz[a] for a in authors if a in bz]
-    return authors
+    return bz
+
+
+def remember_nicks(bz):
+    with _nicks_lock:
+        for name, info in bz.items():
+            _nicks.pop(name, None)
+            _nicks[name] = info
+        while len(_nicks) > NICKS_CACHE_SIZE:
+            _nicks.popitem(last=False)
+
+
+def get_cached_nicks(authors):
+    with _nicks_lock:
+        bz = {a: _nicks[a] for a in authors if a in _nicks}
+    metrics.cache_lookup('nicks', len(bz) == len(authors))
+    for a in authors:
+        if a not in bz:
+            bz[a] = {'name': a,
+                     'real_name': '',
+                     'nick_name': ''}
+    return bz
+
+
+def get_nick(authors, degraded=None):
+    # when Bugzilla is unavailable, the known nicks are used and 'bugzilla'
+    # is added in degraded
+    authors = list(authors)
+    if not authors:
+        return []
+    key = ('nicks', tuple(sorted(authors)))
+    try:
+        bz = outbound.call('bugzilla', key, fetch_nicks, authors)
+        remember_nicks(bz)
+    except outbound.Unavailable:
+        if degraded is not None:
+            degraded.add('bugzilla')
+        bz = get_cached_nicks(authors)
+
+    # the result of a lookup is shared by the callers
+    return [dict(bz[a]) for a in authors if a in bz]
+
+
+def get_load():
+    now = time.time()
+    hit = _load['time'] is not None and now - _load['time'] <= LOAD_TTL
+    metrics.cache_lookup('review_load', hit)
+    if not hit:
+        _load['counts'] = ReviewLoad.get()['load']
+        _load['time'] = now
+    return _load['counts']
+
+
+def weight_by_load(stats, weight):
+    # the more open review requests a reviewer has,
+    # the less we suggest them
+    load = get_load()
+    for author in stats.keys():
+        n = load.get(author, 0)
+        if n:
+            stats[author] /= 1. + weight * n
+
+
+def get_bool(data, key, default):
+    if key not in data:
+        return default
+    value = data[key]
+    if isinstance(value, six.string_types):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def get_histograms(files):
+    return FilesLines.get(files)['lines']
+
+
+def get_component_stats(data):
+    # the component can be given as 'Product::Component',
+    # as {'product': ..., 'component': ...} or from a bug id
+    if 'component' in data:
+        pc = data['component']
+        if isinstance(pc, dict):
+            product = pc.get('product', '')
+            component = pc.get('component', '')
+        elif isinstance(pc, six.string_types) and '::' in pc:
+            product, component = pc.split('::', 1)
+        else:
+            return {}
+        return ComponentsStats.get(product.strip(), component.strip())['stats']
+    elif 'bugid' in data:
+        return ComponentsStats.get_for_bug(data['bugid'])['stats']
+    return {}
 
 
 def percent(scores):
@@ -52,7 +177,7 @@ def percent(scores):
     return percentages
 
 
-def gather(filestats, authors):
+def gather(filestats, authors, active=None):
     gathered_stats = defaultdict(lambda: 0.)
     for stats in filestats.values():
         for author, score in stats.items():
@@ -63,7 +188,7 @@ def gather(filestats, authors):
     # (because they don't commit anything in the last 3 months)
     # for information: we take into account the old devs to compute the score
     # of the actual devs to avoid to have specialists who made almost nothing
-    bzauthors = set(authors.values())
+    bzauthors = set(authors.values()) if active is None else active
     torm = [a for a in gathered_stats.keys() if a not in bzauthors]
     for a in torm:
         del gathered_stats[a]
@@ -89,23 +214,61 @@ def top(files, number=5):
         files = files['files']
     if isinstance(files, six.string_types):
         files = [files]
-    if not isinstance(files, list):
-        files = list(files)
-    filestats = FilesStats.get(files)['stats']
-    authors = Authors.get()['bznames']
-    stats = gather(filestats, authors)
+    files = filter_files(files)
+    snap = snapshot.get_snapshot()
+    if snap is not None:
+        with metrics.timer('filesstats'):
+            filestats = snap.get(files)
+        with metrics.timer('scoring'):
+            stats = gather(filestats, None, active=snap.active)
+    elif use_sql_aggregation():
+        # only the top persons are retrieved from the database
+        with metrics.timer('filesstats'):
+            stats = FilesStats.gather(files, number)['stats']
+    else:
+        with metrics.timer('filesstats'):
+            filestats = FilesStats.get(files)['stats']
+        with metrics.timer('authors'):
+            authors = Authors.get()['bznames']
+        with metrics.timer('scoring'):
+            stats = gather(filestats, authors)
     persons, scores = get_top(stats, number)
-    persons = get_nick(persons)
+    degraded = set()
+    with metrics.timer('nick'):
+        persons = get_nick(persons, degraded)
     for p, s in zip(persons, scores):
         p['score'] = math.floor(s * 1000.) / 10.
 
-    return {'top': persons,
-            'error': ''}
+    res = {'top': persons,
+           'error': ''}
+    if degraded:
+        res['degraded'] = sorted(degraded)
+    return res
+
+
+def get_ranking_key(patch, number):
+    # everything in the payload which changes the response
+    options = {k: v for k, v in patch.items() if k != 'patch'}
+    options['number'] = number
+    if get_bool(patch, 'load', False):
+        # the load is reloaded every LOAD_TTL seconds: an expired one
+        # is reloaded here so the key is the one of the used load
+        get_load()
+        options['load_time'] = _load['time']
+    digest = hashlib.sha1(patch['patch'].encode('utf-8')).hexdigest()
+    return cache.get_key('ranking', [digest, options])
 
 
 def get(patch, number=5):
     logger.info('Get reviewers for patch')
     if isinstance(patch, dict) and 'patch' in patch:
+        generation = cache.get_generation()
+        ranking_key = get_ranking_key(patch, number)
+        res = _rankings.get(generation, ranking_key)
+        metrics.cache_lookup('ranking', res is not None)
+        if res is not None:
+            return copy.deepcopy(res)
+
         ishg = False
         if 'bzauthor' in patch:
             patch_author = patch['bzauthor']
@@ -113,52 +276,101 @@ def get(patch, number=5):
             patch_author = patch['hgauthor']
             ishg = True
 
-        if 'annotations' in patch:
-            check_annotation = patch['annotations']
-            if isinstance(check_annotation, six.string_types):
-                check_annotation = check_annotation.lower()
-                check_annotation = check_annotation == 'true'
-            else:
-                check_annotation = bool(check_annotation)
-        else:
-            check_annotation = True
+        # annotations: true, false or 'approx' to use the number of lines
+        # per author of the large files instead of their annotations
+        approx = patch.get('annotations') == 'approx'
+        check_annotation = approx or get_bool(patch, 'annotations', True)
+        use_load = get_bool(patch, 'load', False)
+        load_weight = float(patch.get('load_weight', LOAD_WEIGHT))
+        payload = patch
         patch = patch['patch']
     else:
         return {'reviewers': [],
                 'error': 'Invalid payload'}
 
-    patch_stats, changed = analyze_patch(patch, check_annotation)
-    changed = list(changed)
-    filestats = FilesStats.get(changed)['stats']
-    deleted = percent(patch_stats['deleted'])
-    alllines = percent(patch_stats['all'])
-    authors = Authors.get()['bznames']
-
-    if ishg:
-        patch_author = authors.get(patch_author, '')
-
-    deleted = {authors[k]: n for k, n in deleted.items() if k in authors}
-    alllines = {authors[k]: n for k, n in alllines.items() if k in authors}
-
-    gathered_stats = gather(filestats, authors)
-
-    # we compute the total score
-    stats = defaultdict(lambda: 0.)
-    names = [deleted, alllines, gathered_stats]
-    notempty = filter(lambda n: n, names)
-    notempty = list(notempty)
-    N = float(len(notempty))
-    for name in names:
-        for author, score in name.items():
-            stats[author] += score / N
-
-    if patch_author in stats:
-        del stats[patch_author]
-
-    reviewers, scores = get_top(stats, number)
-    reviewers = get_nick(reviewers)
+    histograms = get_histograms if approx else None
+    # the upstreams which didn't answer
+    degraded = set()
+    patch_stats, changed = analyze_patch(patch, check_annotation,
+                                         get_histograms=histograms,
+                                         degraded=degraded)
+    changed = sorted(changed)
+    snap = snapshot.get_snapshot()
+    sql = snap is None and use_sql_aggregation()
+    backend = 'snapshot' if snap is not None else 'sql' if sql else 'db'
+    gather_key = cache.get_key('gather', [backend, changed])
+    gathered_stats = _gathered.get(generation, gather_key)
+    metrics.cache_lookup('gather', gathered_stats is not None)
+    with metrics.timer('filesstats'):
+        if gathered_stats is not None:
+            pass
+        elif snap is not None:
+            filestats = snap.get(changed)
+        elif sql:
+            gathered_stats = FilesStats.gather(changed)['stats']
+            _gathered.set(generation, gather_key, gathered_stats)
+        else:
+            filestats = FilesStats.get(changed)['stats']
+    with metrics.timer('authors'):
+        if snap is not None:
+            # only the authors we need
+            hgnames = set(patch_stats['deleted']) | set(patch_stats['all'])
+            if ishg:
+                hgnames.add(patch_author)
+            authors = snap.get_bznames(hgnames)
+        else:
+            authors = Authors.get()['bznames']
+    with metrics.timer('scoring'):
+        deleted = percent(patch_stats['deleted'])
+        alllines = percent(patch_stats['all'])
+
+        if ishg:
+            patch_author = authors.get(patch_author, '')
+
+        deleted = {authors[k]: n for k, n in deleted.items() if k in authors}
+        alllines = {authors[k]: n for k, n in alllines.items()
+                    if k in authors}
+
+        active = snap.active if snap is not None else None
+        if gathered_stats is None:
+            gathered_stats = gather(filestats, authors, active=active)
+            _gathered.set(generation, gather_key, gathered_stats)
+        # the people working in the component of the bug are used
+        # as a fallback when the changed files have no stats (new files)
+        pcstats = {}
+        if not gathered_stats:
+            with metrics.timer('components'):
+                pcstats = get_component_stats(payload)
+            if pcstats:
+                pcstats = gather({'': pcstats}, authors, active=active)
+
+        # we compute the total score
+        stats = defaultdict(lambda: 0.)
+        names = [deleted, alllines, gathered_stats, pcstats]
+        notempty = filter(lambda n: n, names)
+        notempty = list(notempty)
+        N = float(len(notempty))
+        for name in names:
+            for author, score in name.items():
+                stats[author] += score / N
+
+        if patch_author in stats:
+            del stats[patch_author]
+
+        if use_load:
+            weight_by_load(stats, load_weight)
+
+        reviewers, scores = get_top(stats, number)
+
+    with metrics.timer('nick'):
+        reviewers = get_nick(reviewers, degraded)
     for r, s in zip(reviewers, scores):
         r['score'] = math.floor(s * 1000.) / 10.
 
-    return {'reviewers': reviewers,
-            'error': ''}
+    res = {'reviewers': reviewers,
+           'error': ''}
+    if degraded:
+        res['degraded'] = sorted(degraded)
+    else:
+        _rankings.set(generation, ranking_key, copy.deepcopy(res))
+    return res
@@ -0,0 +1,233 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Read-only snapshot of the scores and of the authors written by the
+# collector: the workers mmap it, so they share the same pages and
+# don't query the database.
+#
+# Layout (little-endian):
+#  - header: magic, generation, number of files, of people, of hg authors
+#    and of scores;
+#  - the offsets of the sections;
+#  - the sorted file paths, the sorted bz authors and the sorted hg authors,
+#    each as an array of (N + 1) uint32 offsets followed by the utf-8 blob;
+#  - for each hg author, the index of its bz author (uint32);
+#  - for each bz author, 1 if it is active else 0 (uint8);
+#  - the scores in CSR format: for each file, the range of its scores
+#    (uint32), then the index of the bz author (uint32) and the score
+#    (float64) of each score.
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+import time
+
+
+MAGIC = b'MOZREVS1'
+HEADER = struct.Struct('<8sQIIII')
+SECTIONS = struct.Struct('<11Q')
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '')
+
+_snapshot = {'snapshot': None}
+
+
+def get_array(typecode, values):
+    a = array(typecode, values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def get_strings(strings):
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    return get_array('I', offsets), b''.join(strings)
+
+
+def get_bytes(a):
+    if isinstance(a, bytes):
+        return a
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def write(path, filestats, mapping, generation=None):
+    # filestats: filename => {bzauthor => score}
+    # mapping: hgauthor => bzauthor for the active authors
+    if generation is None:
+        generation = int(time.time())
+
+    files = sorted(f.encode('utf-8') for f in filestats.keys())
+    active = set(mapping.values())
+    people = set(active)
+    for scores in filestats.values():
+        people.update(scores.keys())
+    people = sorted(p.encode('utf-8') for p in people)
+    people_ids = {p.decode('utf-8'): i for i, p in enumerate(people)}
+    hgnames = sorted(a.encode('utf-8') for a in mapping.keys())
+
+    hg_bz = [people_ids[mapping[a.decode('utf-8')]] for a in hgnames]
+    mask = [1 if p.decode('utf-8') in active else 0 for p in people]
+
+    indptr = [0]
+    indices = []
+    scores = []
+    for f in files:
+        stats = filestats[f.decode('utf-8')]
+        ids = sorted((people_ids[p], s) for p, s in stats.items())
+        indices.extend(i for i, _ in ids)
+        scores.extend(s for _, s in ids)
+        indptr.append(len(indices))
+
+    sections = []
+    sections.extend(get_strings(files))
+    sections.extend(get_strings(people))
+    sections.extend(get_strings(hgnames))
+    sections.append(get_array('I', hg_bz))
+    sections.append(get_array('B', mask))
+    sections.append(get_array('I', indptr))
+    sections.append(get_array('I', indices))
+    sections.append(get_array('d', scores))
+    sections = [get_bytes(s) for s in sections]
+
+    offsets = []
+    pos = HEADER.size + SECTIONS.size
+    for s in sections:
+        # the sections are aligned on 8 bytes
+        pos += -pos % 8
+        offsets.append(pos)
+        pos += len(s)
+
+    # the workers must see the old snapshot or the new one, never a part
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as Out:
+        Out.write(HEADER.pack(MAGIC, generation, len(files), len(people),
+                              len(hgnames), len(scores)))
+        Out.write(SECTIONS.pack(*offsets))
+        for offset, s in zip(offsets, sections):
+            Out.write(b'\0' * (offset - Out.tell()))
+            Out.write(s)
+    os.rename(tmp, path)
+
+
+class Strings(object):
+    # a sorted array of strings in the snapshot
+
+    def __init__(self, buf, offsets, blob, N):
+        self.buf = buf
+        self.offsets = offsets
+        self.blob = blob
+        self.N = N
+
+    def __len__(self):
+        return self.N
+
+    def get_bytes(self, i):
+        start, end = struct.unpack_from('<II', self.buf, self.offsets + 4 * i)
+        return self.buf[self.blob + start:self.blob + end]
+
+    def __getitem__(self, i):
+        return self.get_bytes(i).decode('utf-8')
+
+    def find(self, s):
+        s = s.encode('utf-8')
+        lo, hi = 0, self.N
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_bytes(mid) < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.N and self.get_bytes(lo) == s:
+            return lo
+        return -1
+
+
+class Active(object):
+    # the set of the active bz authors
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __contains__(self, bzname):
+        return self.snapshot.is_active(bzname)
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as In:
+            st = os.fstat(In.fileno())
+            self.buf = mmap.mmap(In.fileno(), 0, access=mmap.ACCESS_READ)
+        self.key = (st.st_ino, st.st_mtime, st.st_size)
+        magic, generation, nfiles, npeople, nhg, nscores = \
+            HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise Exception('Invalid snapshot: {}'.format(path))
+        offsets = SECTIONS.unpack_from(self.buf, HEADER.size)
+        self.generation = generation
+        self.files = Strings(self.buf, offsets[0], offsets[1], nfiles)
+        self.people = Strings(self.buf, offsets[2], offsets[3], npeople)
+        self.hgnames = Strings(self.buf, offsets[4], offsets[5], nhg)
+        self.hg_bz = offsets[6]
+        self.mask = offsets[7]
+        self.indptr = offsets[8]
+        self.indices = offsets[9]
+        self.scores = offsets[10]
+        self.active = Active(self)
+
+    def is_active(self, bzname):
+        i = self.people.find(bzname)
+        if i < 0:
+            return False
+        return struct.unpack_from('<B', self.buf, self.mask + i)[0] == 1
+
+    def get_file_stats(self, filename):
+        i = self.files.find(filename)
+        if i < 0:
+            return None
+        start, end = struct.unpack_from('<II', self.buf, self.indptr + 4 * i)
+        N = end - start
+        ids = struct.unpack_from('<{}I'.format(N), self.buf,
+                                 self.indices + 4 * start)
+        scores = struct.unpack_from('<{}d'.format(N), self.buf,
+                                    self.scores + 8 * start)
+        return {self.people[j]: s for j, s in zip(ids, scores)}
+
+    def get(self, filenames):
+        # same as FilesStats.get
+        stats = {}
+        for f in filenames:
+            s = self.get_file_stats(f)
+            if s is not None:
+                stats[f] = s
+        return stats
+
+    def get_bznames(self, hgnames):
+        res = {}
+        for hgname in hgnames:
+            i = self.hgnames.find(hgname)
+            if i >= 0:
+                j = struct.unpack_from('<I', self.buf, self.hg_bz + 4 * i)[0]
+                res[hgname] = self.people[j]
+        return res
+
+
+def get_snapshot():
+    # the snapshot is reopened when the file has been replaced
+    if not SNAPSHOT_PATH:
+        return None
+    try:
+        st = os.stat(SNAPSHOT_PATH)
+    except OSError:
+        return _snapshot['snapshot']
+
+    snapshot = _snapshot['snapshot']
+    if snapshot is None or snapshot.key != (st.st_ino, st.st_mtime,
+                                            st.st_size):
+        # the old mapping is closed once the requests using it are done
+        _snapshot['snapshot'] = Snapshot(SNAPSHOT_PATH)
+    return _snapshot['snapshot']
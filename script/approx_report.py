@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Compare the rankings of /reviewers with the exact annotations and with
+# the approximation of the large files on sampled patches:
+#   python script/approx_report.py --commits 1000 --min-lines 200
+# The results are appended to the JSON file given with --output.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import bench  # noqa
+import fixtures  # noqa
+
+
+def get_agreement(exact, approx, number):
+    # the part of the exact top which is in the approximated one
+    exact = [r['name'] for r in exact]
+    approx = [r['name'] for r in approx]
+    if not exact:
+        return 1. if not approx else 0., not approx
+    common = len(set(exact[:number]) & set(approx[:number]))
+    same_first = bool(approx) and exact[0] == approx[0]
+    return float(common) / len(exact[:number]), same_first
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the exact and the '
+                                                 'approximated rankings')
+    parser.add_argument('--commits', type=int, default=500,
+                        help='number of commits in the hg repository')
+    parser.add_argument('--authors', type=int, default=30,
+                        help='number of authors')
+    parser.add_argument('--files', type=int, default=200,
+                        help='number of files')
+    parser.add_argument('--bugs', type=int, default=200,
+                        help='number of bugs')
+    parser.add_argument('--patches', type=int, default=50,
+                        help='number of sampled patches')
+    parser.add_argument('--number', type=int, default=5,
+                        help='number of reviewers')
+    parser.add_argument('--min-lines', type=int, default=50,
+                        help='files with at least this number of lines '
+                             'are approximated')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic data')
+    parser.add_argument('--output', default='approx_results.json',
+                        help='JSON file where the results are appended')
+    args = parser.parse_args()
+    # the computations are timed, not the memoization of their results
+    bench.no_memoization()
+
+    tmp = tempfile.mkdtemp(prefix='mozreviewers-approx-')
+    db = 'sqlite:///' + os.path.join(tmp, 'approx.db')
+    os.environ['DATABASE_URL'] = db
+    repo = os.path.join(tmp, 'repo')
+
+    upstreams = fixtures.Upstreams(fixtures.get_authors(args.authors),
+                                   seed=args.seed, repo=repo)
+    server, url = fixtures.start_upstreams(upstreams)
+    fixtures.use_upstreams(url)
+
+    results = {}
+    try:
+        cargs = argparse.Namespace(**dict(vars(args), workers=1))
+        _, filestats, mapping = bench.bench_collector(cargs, tmp, url, {})
+
+        from mozreviewers import hgdata, models, reviewers
+        from mozreviewers.app import app
+
+        files = fixtures.get_files(args.files, seed=args.seed)
+        histograms = hgdata.get_lines_histograms(repo, files, args.min_lines)
+        histograms = {f: h for f, h in histograms.items() if h}
+        results['large_files'] = len(histograms)
+
+        patches = fixtures.get_patches(repo, args.patches, seed=args.seed)
+        times = {'exact': [], 'approx': []}
+        agreements = []
+        first = 0
+        with app.app_context():
+            bench.fill_db(filestats, mapping)
+            models.FilesLines.post({'command': 'create',
+                                    'data': histograms})
+            # the fake json-annotate caches the annotations it computes
+            for p in patches:
+                reviewers.get({'patch': p['patch'],
+                               'hgauthor': p['hgauthor']})
+            for p in patches:
+                res = {}
+                for mode, annotations in [('exact', True),
+                                          ('approx', 'approx')]:
+                    start = time.time()
+                    r = reviewers.get({'patch': p['patch'],
+                                       'hgauthor': p['hgauthor'],
+                                       'annotations': annotations},
+                                      number=args.number)
+                    times[mode].append(time.time() - start)
+                    res[mode] = r['reviewers']
+                agreement, same_first = get_agreement(res['exact'],
+                                                      res['approx'],
+                                                      args.number)
+                agreements.append(agreement)
+                first += int(same_first)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+    N = len(agreements)
+    results['overlap'] = sum(agreements) / N
+    results['same_first'] = float(first) / N
+    for mode, t in times.items():
+        results[mode] = bench.summarize(t)
+
+    run = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': bench.get_revision(),
+           'python': platform.python_version(),
+           'params': {k: v for k, v in vars(args).items() if k != 'output'},
+           'results': results}
+
+    runs = []
+    if os.path.isfile(args.output):
+        with open(args.output, 'r') as In:
+            runs = json.load(In)
+    runs.append(run)
+    with open(args.output, 'w') as Out:
+        json.dump(runs, Out, indent=1)
+
+    print('large files: {}'.format(results['large_files']))
+    print('overlap of the top {}: {:.3f}'.format(args.number,
+                                                 results['overlap']))
+    print('same first reviewer: {:.3f}'.format(results['same_first']))
+    for mode in ['exact', 'approx']:
+        print('{}: mean={:.4f}s, median={:.4f}s'.format(
+            mode, results[mode]['mean'], results[mode]['median']))
+
+
+if __name__ == '__main__':
+    main()
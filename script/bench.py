@@ -0,0 +1,208 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Benchmark the collector and the reviewers computation on synthetic data:
+#   python script/bench.py --commits 2000 --authors 200 --files 5000
+# The results are appended to the JSON file given with --output.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fixtures  # noqa
+
+
+def get_revision():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      cwd=HERE)
+        return out.decode('ascii').strip()
+    except Exception:
+        return ''
+
+
+def summarize(times):
+    times = sorted(times)
+    N = len(times)
+    return {'times': times,
+            'mean': sum(times) / N,
+            'min': times[0],
+            'median': times[N // 2],
+            'p95': times[int(round(0.95 * (N - 1)))],
+            'max': times[-1]}
+
+
+def no_memoization():
+    os.environ['GATHER_CACHE_SIZE'] = '0'
+    os.environ['RANKING_CACHE_SIZE'] = '0'
+
+
+def bench_collector(args, tmp, url, results):
+    from mozreviewers import collect, profiling
+
+    repo = os.path.join(tmp, 'repo')
+    authors = fixtures.get_authors(args.authors)
+    files = fixtures.get_files(args.files, seed=args.seed)
+    start = time.time()
+    fixtures.make_hg_repo(repo, args.commits, authors, files, args.bugs,
+                          seed=args.seed)
+    results['setup_hg_repo'] = time.time() - start
+
+    post_info = {'url': url,
+                 'token': ''}
+    data_path = os.path.join(tmp, 'authors_data.json')
+    mapping_path = os.path.join(tmp, 'mapping.json')
+    fstats_path = os.path.join(tmp, 'filestats.json')
+    landed_path = os.path.join(tmp, 'landed.json')
+    report_path = os.path.join(tmp, 'report.json')
+    with open(fstats_path, 'w') as Out:
+        json.dump({}, Out)
+
+    # the collector stages are timed by the profiling module
+    profiling.start(report_path)
+    jsons = {}
+    _, stats, buginfo, patches, backouts = collect.get_stats(repo, data_path,
+                                                             jsons)
+    mapping = collect.update_mapping(stats, mapping_path, post_info, jsons)
+    collect.update_file_stats(patches, buginfo, mapping, fstats_path,
+                              post_info, jsons, workers=args.workers,
+                              backouts=backouts, landed_path=landed_path)
+    profiling.stop('bench')
+
+    with open(report_path, 'r') as In:
+        report = json.load(In)[-1]
+    for stage in report['stages']:
+        results[stage['stage']] = {'time': stage['time'],
+                                   'maxrss': stage['maxrss'],
+                                   'counts': stage['counts']}
+
+    return repo, jsons[fstats_path], jsons[mapping_path]
+
+
+def fill_db(filestats, mapping):
+    from mozreviewers import models
+    models.create()
+    models.Authors.post({'command': 'create',
+                         'data': {'toinsert': mapping,
+                                  'torm': []}})
+    models.FilesStats.post({'command': 'create',
+                            'data': filestats})
+
+
+def bench_reviewers(args, repo, filestats, results):
+    from mozreviewers import reviewers
+
+    patches = fixtures.get_patches(repo, args.patches, seed=args.seed)
+    times = []
+    for _ in range(args.repeat):
+        for p in patches:
+            start = time.time()
+            reviewers.get({'patch': p['patch'],
+                           'hgauthor': p['hgauthor']})
+            times.append(time.time() - start)
+    results['reviewers.get'] = summarize(times)
+
+    rng = fixtures.get_rng('top', args.seed)
+    files = sorted(filestats.keys())
+    times = []
+    for _ in range(args.repeat):
+        for _ in range(args.patches):
+            f = rng.sample(files, min(len(files), rng.randint(1, 20)))
+            start = time.time()
+            reviewers.top(f, 5)
+            times.append(time.time() - start)
+    results['reviewers.top'] = summarize(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mozreviewers')
+    parser.add_argument('--commits', type=int, default=500,
+                        help='number of commits in the hg repository')
+    parser.add_argument('--authors', type=int, default=50,
+                        help='number of authors')
+    parser.add_argument('--files', type=int, default=1000,
+                        help='number of files')
+    parser.add_argument('--bugs', type=int, default=300,
+                        help='number of bugs')
+    parser.add_argument('--patches', type=int, default=20,
+                        help='number of patches for reviewers.get')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of repetitions for the requests')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes for update_file_stats')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='latency (in seconds) of the fake upstreams')
+    parser.add_argument('--db', default='',
+                        help='database URL (default: a temporary SQLite db)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic data')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='JSON file where the results are appended')
+    args = parser.parse_args()
+    # the computations are timed, not the memoization of their results
+    no_memoization()
+
+    tmp = tempfile.mkdtemp(prefix='mozreviewers-bench-')
+    db = args.db or 'sqlite:///' + os.path.join(tmp, 'bench.db')
+    os.environ['DATABASE_URL'] = db
+
+    upstreams = fixtures.Upstreams(fixtures.get_authors(args.authors),
+                                   latency=args.latency,
+                                   seed=args.seed,
+                                   repo=os.path.join(tmp, 'repo'))
+    server, url = fixtures.start_upstreams(upstreams)
+    fixtures.use_upstreams(url)
+
+    results = {}
+    try:
+        repo, filestats, mapping = bench_collector(args, tmp, url, results)
+
+        from mozreviewers.app import app
+        with app.app_context():
+            start = time.time()
+            fill_db(filestats, mapping)
+            results['setup_db'] = time.time() - start
+            bench_reviewers(args, repo, filestats, results)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+    run = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': get_revision(),
+           'python': platform.python_version(),
+           'db': db.split(':', 1)[0],
+           'params': {k: v for k, v in vars(args).items()
+                      if k not in ['output', 'db']},
+           'results': results}
+
+    runs = []
+    if os.path.isfile(args.output):
+        with open(args.output, 'r') as In:
+            runs = json.load(In)
+    runs.append(run)
+    with open(args.output, 'w') as Out:
+        json.dump(runs, Out, indent=1)
+
+    for name, res in sorted(results.items()):
+        if isinstance(res, dict):
+            t = res.get('mean', res.get('time'))
+        else:
+            t = res
+        print('{}: {:.4f}s'.format(name, t))
+
+
+if __name__ == '__main__':
+    main()
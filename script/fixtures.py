@@ -0,0 +1,308 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Synthetic data and local stand-ins for Bugzilla and hg.mozilla.org
+# used by the benchmarks and the load tests.
+
+import hashlib
+import hglib
+import json
+import os
+import random
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+import threading
+import time
+
+
+DIRS = ['dom', 'layout', 'gfx', 'js/src', 'netwerk', 'toolkit', 'browser',
+        'widget', 'xpcom', 'media', 'mobile', 'devtools']
+EXTS = ['.cpp', '.h', '.js', '.py', '.rs']
+
+
+def get_rng(*keys):
+    key = '-'.join(str(k) for k in keys).encode('utf-8')
+    seed = int(hashlib.md5(key).hexdigest()[:8], 16)
+    return random.Random(seed)
+
+
+def get_authors(M):
+    # hg author, bz email
+    res = []
+    for i in range(M):
+        email = 'dev{}@example.com'.format(i)
+        res.append(('Developer {} <{}>'.format(i, email), email))
+    return res
+
+
+def get_files(K, seed=0):
+    rng = get_rng('files', seed)
+    res = []
+    for i in range(K):
+        d = rng.choice(DIRS)
+        res.append('{}/file{}{}'.format(d, i, rng.choice(EXTS)))
+    return res
+
+
+def get_bugids(N, seed=0):
+    return list(range(1000000, 1000000 + N))
+
+
+def get_nick(email):
+    return email.split('@')[0]
+
+
+def make_hg_repo(path, commits, authors, files, bugs, seed=0):
+    # the repo is a clone of an origin, so get_hg_info can pull from it
+    origin = path + '-origin'
+    rng = get_rng('repo', seed)
+    hglib.init(origin)
+    client = hglib.open(origin)
+    bugids = get_bugids(bugs, seed=seed)
+    lines = {}
+    for i in range(commits):
+        author, email = rng.choice(authors)
+        reviewer = get_nick(rng.choice(authors)[1])
+        bugid = rng.choice(bugids)
+        touched = rng.sample(files, min(len(files), rng.randint(1, 5)))
+        added = []
+        for f in touched:
+            full = os.path.join(origin, f)
+            if f not in lines:
+                lines[f] = []
+                added.append(full)
+                d = os.path.dirname(full)
+                if not os.path.isdir(d):
+                    os.makedirs(d)
+            content = lines[f]
+            n = rng.randint(1, 20)
+            for _ in range(n):
+                pos = rng.randint(0, len(content))
+                content.insert(pos, 'line {} from {}'.format(i, email))
+            # removing the only new line could leave the file unchanged
+            if len(content) > 10 and rng.random() < 0.5 and n > 1:
+                del content[rng.randrange(len(content))]
+            with open(full, 'w') as Out:
+                Out.write('\n'.join(content) + '\n')
+
+        if added:
+            client.add([f.encode('utf-8') for f in added])
+        msg = 'Bug {} - Change number {}; r={}'.format(bugid, i, reviewer)
+        client.commit(message=msg.encode('utf-8'),
+                      user=author.encode('utf-8'))
+    client.close()
+    hglib.clone(source=origin.encode('utf-8'), dest=path.encode('utf-8'))
+    return origin
+
+
+def get_patches(path, number, seed=0):
+    # some patches from the history in git format
+    rng = get_rng('patches', seed)
+    client = hglib.open(path)
+    out = client.log(nomerges=True)
+    res = []
+    for o in rng.sample(out, min(number, len(out))):
+        rev, _, _, _, author, desc, _ = o
+        patch = client.export([rev], git=True).decode('utf-8')
+        res.append({'patch': patch,
+                    'hgauthor': author.decode('utf-8'),
+                    'desc': desc.decode('utf-8')})
+    client.close()
+    return res
+
+
+class Upstreams(object):
+    # fake Bugzilla REST API and hg json-annotate
+
+    def __init__(self, authors, latency=0., seed=0, repo=None):
+        self.authors = authors
+        self.latency = latency
+        self.seed = seed
+        self.repo = repo
+        self.annotations = {}
+        self.lock = threading.Lock()
+        self.posted = []
+
+    def get_person(self, rng):
+        author, email = rng.choice(self.authors)
+        name = author.split(' <')[0]
+        return email, name
+
+    def get_bug(self, bugid):
+        rng = get_rng('bug', bugid, self.seed)
+        assignee, aname = self.get_person(rng)
+        creator, cname = self.get_person(rng)
+        cc = [self.get_person(rng) for _ in range(rng.randint(0, 5))]
+        return {'id': bugid,
+                'assigned_to': assignee,
+                'assigned_to_detail': {'email': assignee,
+                                       'real_name': aname},
+                'creator_detail': {'email': creator,
+                                   'real_name': cname},
+                'cc_detail': [{'email': e,
+                               'real_name': n} for e, n in cc],
+                'product': 'Product{}'.format(rng.randint(0, 9)),
+                'component': 'Component{}'.format(rng.randint(0, 19))}
+
+    def get_comments(self, bugid):
+        rng = get_rng('comments', bugid, self.seed)
+        comments = []
+        for i in range(rng.randint(1, 10)):
+            author, _ = self.get_person(rng)
+            attachment = 100 * bugid + i if rng.random() < 0.3 else None
+            comments.append({'author': author,
+                             'attachment_id': attachment})
+        return {'comments': comments}
+
+    def get_history(self, bugid):
+        rng = get_rng('history', bugid, self.seed)
+        history = []
+        for i in range(rng.randint(0, 4)):
+            who, _ = self.get_person(rng)
+            reviewer, _ = self.get_person(rng)
+            attachment = 100 * bugid + i
+            added = 'review?({})'.format(reviewer)
+            history.append({'who': who,
+                            'changes': [{'field_name': 'flagtypes.name',
+                                         'attachment_id': attachment,
+                                         'added': added,
+                                         'removed': ''}]})
+            if rng.random() < 0.7:
+                history.append({'who': reviewer,
+                                'changes': [{'field_name': 'flagtypes.name',
+                                             'attachment_id': attachment,
+                                             'added': 'review+',
+                                             'removed': added}]})
+        return {'id': bugid,
+                'history': history}
+
+    def get_user(self, name):
+        nick = get_nick(name)
+        return {'name': name,
+                'real_name': 'Developer [:{}]'.format(nick)}
+
+    def get_annotate(self, path):
+        if self.repo:
+            return self.get_repo_annotate(path)
+        rng = get_rng('annotate', path, self.seed)
+        annotate = []
+        for i in range(rng.randint(10, 500)):
+            author, _ = rng.choice(self.authors)
+            annotate.append({'author': author,
+                             'lineno': i + 1})
+        return {'annotate': annotate}
+
+    def get_repo_annotate(self, path):
+        # the blame of the tip in the synthetic repository: the files only
+        # grow, so the line numbers in the patches of its history are valid
+        with self.lock:
+            if path not in self.annotations:
+                client = hglib.open(self.repo)
+                full = os.path.join(self.repo, path).encode('utf-8')
+                try:
+                    out = client.rawcommand([b'annotate', b'-T', b'json',
+                                             b'-u', full])
+                    lines = json.loads(out.decode('utf-8'))[0]['lines']
+                    annotate = [{'author': l['user'],
+                                 'lineno': i + 1}
+                                for i, l in enumerate(lines)]
+                    self.annotations[path] = {'annotate': annotate}
+                except hglib.error.CommandError:
+                    self.annotations[path] = None
+                finally:
+                    client.close()
+            return self.annotations[path]
+
+    def handle_get(self, path, query):
+        toks = [t for t in path.split('/') if t]
+        if 'json-annotate' in toks:
+            # the path is either a parameter or after the node in the url
+            if 'file' in query:
+                return self.get_annotate(query['file'][0])
+            i = toks.index('json-annotate')
+            return self.get_annotate('/'.join(toks[i + 2:]))
+        if toks[:2] == ['rest', 'user']:
+            names = []
+            for n in query.get('names', []):
+                names += n.split(',')
+            return {'users': [self.get_user(n) for n in names]}
+        if toks[:2] == ['rest', 'bug']:
+            ids = []
+            for i in query.get('id', []) + query.get('ids', []):
+                ids += [int(x) for x in i.split(',') if x]
+            if len(toks) >= 3:
+                ids.insert(0, int(toks[2]))
+            if len(toks) == 4 and toks[3] == 'comment':
+                return {'bugs': {str(i): self.get_comments(i) for i in ids}}
+            if len(toks) == 4 and toks[3] == 'history':
+                return {'bugs': [self.get_history(i) for i in ids]}
+            return {'bugs': [self.get_bug(i) for i in ids]}
+        return None
+
+    def get_handler(self):
+        upstreams = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def send_json(self, data):
+                if data is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if upstreams.latency:
+                    time.sleep(upstreams.latency)
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                self.send_json(upstreams.handle_get(url.path, query))
+
+            def do_POST(self):
+                # the collector pushes its diffs here
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length).decode('utf-8'))
+                upstreams.posted.append((self.path, data))
+                self.send_json({'error': ''})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def start_upstreams(upstreams, port=0):
+    server = Server(('127.0.0.1', port), upstreams.get_handler())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    return server, url
+
+
+def use_upstreams(url):
+    # make libmozdata query the local stand-ins
+    from libmozdata import bugzilla, hgmozilla
+    bugzilla.Bugzilla.URL = url
+    bugzilla.Bugzilla.API_URL = url + '/rest/bug'
+    bugzilla.Bugzilla.ATTACHMENT_API_URL = url + '/rest/bug/attachment'
+    bugzilla.BugzillaUser.URL = url
+    bugzilla.BugzillaUser.API_URL = url + '/rest/user'
+    hgmozilla.Mercurial.HG_URL = url
+
+
+def write_mozdata_ini(directory, url):
+    # the same for a process started in this directory
+    with open(os.path.join(directory, 'mozdata.ini'), 'w') as Out:
+        Out.write('[Bugzilla]\nURL = {}\n\n'.format(url))
+        Out.write('[Mercurial]\nURL = {}\n'.format(url))
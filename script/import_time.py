@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Measure the time to import the modules loaded by a gunicorn worker:
+#   python script/import_time.py --repeat 10
+# Each import is made in a fresh interpreter.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# what a worker imports at boot and when it handles its first requests
+MODULES = ['mozreviewers.app',
+           'mozreviewers.api',
+           'mozreviewers.collect']
+HEAVY = ['libmozdata', 'whatthepatch', 'nltk', 'sklearn', 'scipy', 'numpy',
+         'hglib']
+
+CODE = """
+import json
+import sys
+import time
+start = time.time()
+import {module}
+duration = time.time() - start
+heavy = [m for m in {heavy} if m in sys.modules]
+print(json.dumps({{'time': duration, 'heavy': heavy}}))
+"""
+
+
+def measure(module, env):
+    code = CODE.format(module=module, heavy=HEAVY)
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=ROOT, env=env)
+    return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import times')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of measures for each module')
+    parser.add_argument('modules', nargs='*', default=MODULES,
+                        help='the modules to import')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, env.get('PYTHONPATH', '')])
+
+    for module in args.modules:
+        times = []
+        heavy = []
+        for _ in range(args.repeat):
+            res = measure(module, env)
+            times.append(res['time'])
+            heavy = res['heavy']
+        times.sort()
+        print('{}: median={:.4f}s, min={:.4f}s, loads: {}'.format(
+            module, times[len(times) // 2], times[0],
+            ', '.join(heavy) or 'nothing heavy'))
+
+
+if __name__ == '__main__':
+    main()
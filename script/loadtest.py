@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Load test the web service run by gunicorn against slow local stand-ins
+# of Bugzilla and hg.mozilla.org:
+#   python script/loadtest.py --latency 0.2 --worker-class sync gevent
+# Each endpoint is loaded in turn with each number of concurrent clients
+# given with --concurrency, e.g.:
+#   python script/loadtest.py --endpoints top filestats --concurrency 1 10 50
+# The results are appended to the JSON file given with --output.
+
+import argparse
+import json
+import os
+import platform
+import requests
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+import bench  # noqa
+import fixtures  # noqa
+
+
+ENDPOINTS = ['reviewers', 'top', 'filestats', 'authors']
+
+
+def get_free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def percentile(times, p):
+    i = int(round(p / 100. * (len(times) - 1)))
+    return times[i]
+
+
+def start_server(args, tmp, db, worker_class):
+    port = get_free_port()
+    env = dict(os.environ)
+    env['DATABASE_URL'] = db
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, env.get('PYTHONPATH', '')])
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    if not args.memoize:
+        # the same patches are sent again and again
+        env['GATHER_CACHE_SIZE'] = '0'
+        env['RANKING_CACHE_SIZE'] = '0'
+        env['RESPONSE_CACHE_SIZE'] = '0'
+        env.pop('RESPONSE_CACHE_DIR', None)
+    cmd = [sys.executable, '-m', 'gunicorn',
+           '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+           '-k', worker_class,
+           '-w', str(args.workers),
+           '--worker-connections', str(max(args.concurrency)),
+           '-b', '127.0.0.1:{}'.format(port),
+           'mozreviewers.app:app']
+    # libmozdata reads mozdata.ini in the current directory
+    proc = subprocess.Popen(cmd, cwd=tmp, env=env)
+    url = 'http://127.0.0.1:{}'.format(port)
+    for _ in range(300):
+        try:
+            requests.get(url + '/metrics', timeout=5)
+            return proc, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    proc.terminate()
+    raise Exception('gunicorn didn\'t start')
+
+
+def get_requests(patches, number):
+    # endpoint => [(method, path, payload)] built from the patches
+    from mozreviewers.patch_analysis import get_files
+
+    res = {'reviewers': [],
+           'top': [],
+           'filestats': [],
+           'authors': []}
+    for p in patches:
+        files = get_files(p['patch'])
+        files = files['touched'] + files['added'] + \
+            list(files['moved'].values())
+        res['reviewers'].append(('POST', '/reviewers',
+                                 {'patch': p['patch'],
+                                  'hgauthor': p['hgauthor']}))
+        res['top'].append(('GET', '/top', {'file': files,
+                                           'number': number}))
+        res['filestats'].append(('GET', '/filestats', {'file': files}))
+        res['authors'].append(('GET', '/authors',
+                               {'person': p['hgauthor']}))
+    return res
+
+
+def run_load(url, todo, concurrency, timeout):
+    times = []
+    errors = [0]
+    lock = threading.Lock()
+    index = [0]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = index[0]
+                index[0] += 1
+            if i >= len(todo):
+                return
+            method, path, payload = todo[i]
+            start = time.time()
+            try:
+                if method == 'GET':
+                    r = session.get(url + path, params=payload,
+                                    timeout=timeout)
+                else:
+                    r = session.post(url + path, json=payload,
+                                     timeout=timeout)
+                ok = r.status_code == 200 and not r.json().get('error')
+            except (requests.exceptions.RequestException, ValueError):
+                ok = False
+            duration = time.time() - start
+            with lock:
+                times.append(duration)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.time() - start
+
+    times.sort()
+    return {'requests': len(times),
+            'errors': errors[0],
+            'error_rate': float(errors[0]) / len(times),
+            'time': duration,
+            'rps': len(times) / duration,
+            'p50': percentile(times, 50),
+            'p95': percentile(times, 95),
+            'p99': percentile(times, 99),
+            'max': times[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test mozreviewers')
+    parser.add_argument('--commits', type=int, default=200,
+                        help='number of commits in the hg repository')
+    parser.add_argument('--authors', type=int, default=20,
+                        help='number of authors')
+    parser.add_argument('--files', type=int, default=300,
+                        help='number of files')
+    parser.add_argument('--bugs', type=int, default=100,
+                        help='number of bugs')
+    parser.add_argument('--patches', type=int, default=20,
+                        help='number of distinct patches')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='number of requests for each endpoint')
+    parser.add_argument('--endpoints', nargs='+', default=ENDPOINTS,
+                        choices=ENDPOINTS,
+                        help='the endpoints to load')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[20],
+                        help='numbers of concurrent clients')
+    parser.add_argument('--number', type=int, default=5,
+                        help='number of persons asked to /top')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='number of gunicorn workers')
+    parser.add_argument('--worker-class', nargs='+',
+                        default=['sync', 'gevent'],
+                        help='the gunicorn worker classes to compare')
+    parser.add_argument('--memoize', action='store_true',
+                        help='keep the memoization of the gathered scores, '
+                             'of the rankings and of the responses')
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='latency (in seconds) of the fake upstreams')
+    parser.add_argument('--timeout', type=float, default=60.,
+                        help='timeout (in seconds) of a request')
+    parser.add_argument('--db', default='',
+                        help='database URL (default: a temporary SQLite db)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic data')
+    parser.add_argument('--output', default='loadtest_results.json',
+                        help='JSON file where the results are appended')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='mozreviewers-loadtest-')
+    db = args.db or 'sqlite:///' + os.path.join(tmp, 'loadtest.db')
+    os.environ['DATABASE_URL'] = db
+
+    # no latency while the data are collected
+    upstreams = fixtures.Upstreams(fixtures.get_authors(args.authors),
+                                   seed=args.seed,
+                                   repo=os.path.join(tmp, 'repo'))
+    server, url = fixtures.start_upstreams(upstreams)
+    fixtures.use_upstreams(url)
+    fixtures.write_mozdata_ini(tmp, url)
+
+    results = {}
+    try:
+        # the collector runs in a single process
+        cargs = argparse.Namespace(**dict(vars(args), workers=1))
+        repo, filestats, mapping = bench.bench_collector(cargs, tmp, url, {})
+        from mozreviewers.app import app
+        with app.app_context():
+            bench.fill_db(filestats, mapping)
+
+        patches = fixtures.get_patches(repo, args.patches, seed=args.seed)
+        todos = get_requests(patches, args.number)
+        upstreams.latency = args.latency
+
+        for worker_class in args.worker_class:
+            results[worker_class] = {}
+            proc, web = start_server(args, tmp, db, worker_class)
+            try:
+                for endpoint in args.endpoints:
+                    todo = todos[endpoint]
+                    todo = [todo[i % len(todo)]
+                            for i in range(args.requests)]
+                    results[worker_class][endpoint] = {}
+                    for concurrency in args.concurrency:
+                        res = run_load(web, todo, concurrency, args.timeout)
+                        results[worker_class][endpoint][concurrency] = res
+                        print('{} /{} x{}: {:.1f} req/s, p50={:.3f}s, '
+                              'p95={:.3f}s, p99={:.3f}s, errors={}/{}'.format(
+                                  worker_class, endpoint, concurrency,
+                                  res['rps'], res['p50'], res['p95'],
+                                  res['p99'], res['errors'],
+                                  res['requests']))
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
+
+    run = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': bench.get_revision(),
+           'python': platform.python_version(),
+           'db': db.split(':', 1)[0],
+           'params': {k: v for k, v in vars(args).items()
+                      if k not in ['output', 'db']},
+           'results': results}
+
+    runs = []
+    if os.path.isfile(args.output):
+        with open(args.output, 'r') as In:
+            runs = json.load(In)
+    runs.append(run)
+    with open(args.output, 'w') as Out:
+        json.dump(runs, Out, indent=1)
+
+
+if __name__ == '__main__':
+    main()
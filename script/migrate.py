@@ -0,0 +1,24 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Copy the old filesstats table in the normalized tables
+# (files, people and filesscores): DATABASE_URL must be set.
+
+import argparse
+from mozreviewers.app import app
+from mozreviewers import models
+
+
+parser = argparse.ArgumentParser(description='Migrate the filesstats table')
+parser.add_argument('-b', '--batch', type=int, default=10000,
+                    help='number of rows copied per transaction')
+parser.add_argument('--drop', action='store_true',
+                    help='drop the old table once copied')
+args = parser.parse_args()
+
+with app.app_context():
+    n = models.migrate_filesstats(batch=args.batch, drop=args.drop)
+    print('{} rows copied'.format(n))
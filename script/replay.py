@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Replay landed changesets and check if their actual reviewers (the r=...
+# of the commit message) are in the top returned by /reviewers, for each
+# way of computing it:
+#   python script/replay.py --commits 1000 --replay 100
+# compares the modes on a synthetic repository: the data are collected
+# from the first changesets and frozen, then the last ones are replayed.
+#   python script/replay.py --repo mozilla-central --revrange '-500:tip' \
+#                           --snapshot /data/snapshot.bin
+# replays the given changesets against the database in DATABASE_URL
+# (and the snapshot), using the real Bugzilla and hg.mozilla.org.
+# The results are appended to the JSON file given with --output.
+
+import argparse
+import hglib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import bench  # noqa
+import fixtures  # noqa
+
+
+# mode => payload options
+MODES = {'exact': {'annotations': True},
+         'approx': {'annotations': 'approx'},
+         'noannotations': {'annotations': False},
+         'load': {'annotations': True,
+                  'load': True},
+         'snapshot': {'annotations': True},
+         'sql': {'annotations': True}}
+
+
+def get_changesets(repo, revrange, number):
+    # the last reviewed changesets of revrange with their patch
+    from mozreviewers import hgdata
+
+    client = hglib.open(repo)
+    out = client.log(revrange=revrange, nomerges=True)
+    res = []
+    for o in out:
+        rev, node, _, _, author, desc, _ = o
+        desc = desc.decode('utf-8')
+        if not hgdata.get_bug_from(desc):
+            # a backout or a changeset without bug
+            continue
+        reviewers = hgdata.get_reviewers_from(desc)
+        if not reviewers:
+            continue
+        res.append({'rev': rev,
+                    'node': node.decode('ascii'),
+                    'hgauthor': author.decode('utf-8'),
+                    'reviewers': reviewers})
+    if number:
+        res = res[-number:]
+    for c in res:
+        c['patch'] = client.export([c.pop('rev')], git=True).decode('utf-8')
+    client.close()
+    return res
+
+
+def setup_synthetic(args, tmp, url):
+    # collect the data from the first changesets and return the other ones
+    from mozreviewers import collect, hgdata, models, snapshot
+
+    repo = os.path.join(tmp, 'repo')
+    authors = fixtures.get_authors(args.authors)
+    files = fixtures.get_files(args.files, seed=args.seed)
+    fixtures.make_hg_repo(repo, args.commits, authors, files, args.bugs,
+                          seed=args.seed)
+
+    post_info = {'url': url,
+                 'token': ''}
+    data_path = os.path.join(tmp, 'authors_data.json')
+    mapping_path = os.path.join(tmp, 'mapping.json')
+    fstats_path = os.path.join(tmp, 'filestats.json')
+    jsons = {}
+    _, stats, buginfo, patches, backouts = \
+        collect.get_stats(repo, data_path, jsons,
+                          limit=args.commits - args.replay)
+    mapping = collect.update_mapping(stats, mapping_path, post_info, jsons)
+    collect.update_file_stats(patches, buginfo, mapping, fstats_path,
+                              post_info, jsons, workers=1,
+                              backouts=backouts)
+    filestats = jsons[fstats_path]
+    last_rev = jsons[data_path]['last_revs'][repo]
+
+    bench.fill_db(filestats, mapping)
+    histograms = hgdata.get_lines_histograms(repo, list(filestats.keys()),
+                                             args.min_lines)
+    histograms = {f: h for f, h in histograms.items() if h}
+    models.FilesLines.post({'command': 'create',
+                            'data': histograms})
+    path = os.path.join(tmp, 'snapshot.bin')
+    snapshot.write(path, filestats, mapping)
+
+    revrange = '{0}:tip - {0}'.format(last_rev)
+    return get_changesets(repo, revrange, args.replay), path
+
+
+def set_mode(app, mode, snapshot_path):
+    from mozreviewers import snapshot
+
+    snapshot.SNAPSHOT_PATH = snapshot_path if mode == 'snapshot' else ''
+    app.config['SQL_AGGREGATION'] = 'true' if mode == 'sql' else 'false'
+
+
+def get_hits(actual, suggested):
+    # the nicks are compared without the ':'
+    actual = set(r.lower() for r in actual)
+    nicks = set(r['nick_name'].lstrip(':').lower() for r in suggested)
+    found = len(actual & nicks)
+    return int(found != 0), float(found) / len(actual)
+
+
+def replay(app, changesets, modes, number, snapshot_path):
+    from mozreviewers import reviewers
+
+    res = {mode: {'hits': [],
+                  'recalls': [],
+                  'times': []} for mode in modes}
+    # the first calls fill the caches of the upstreams
+    set_mode(app, 'exact', snapshot_path)
+    for c in changesets:
+        reviewers.get({'patch': c['patch'],
+                       'hgauthor': c['hgauthor']})
+
+    for c in changesets:
+        for mode in modes:
+            set_mode(app, mode, snapshot_path)
+            payload = dict(MODES[mode], patch=c['patch'],
+                           hgauthor=c['hgauthor'])
+            start = time.time()
+            r = reviewers.get(payload, number=number)
+            res[mode]['times'].append(time.time() - start)
+            hit, recall = get_hits(c['reviewers'], r['reviewers'])
+            res[mode]['hits'].append(hit)
+            res[mode]['recalls'].append(recall)
+
+    results = {}
+    for mode, r in res.items():
+        N = float(len(r['hits']))
+        times = bench.summarize(r['times'])
+        results[mode] = {'hit_rate': sum(r['hits']) / N,
+                         'recall': sum(r['recalls']) / N,
+                         'p50': times['median'],
+                         'p95': times['p95'],
+                         'mean': times['mean']}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay landed changesets '
+                                                 'and measure the rankings')
+    parser.add_argument('--repo', default='',
+                        help='replay this repository against DATABASE_URL '
+                             '(default: a synthetic repository)')
+    parser.add_argument('--revrange', default='-200:tip',
+                        help='the changesets of --repo to replay')
+    parser.add_argument('--snapshot', default='',
+                        help='the snapshot of the data of --repo')
+    parser.add_argument('--commits', type=int, default=500,
+                        help='number of commits in the synthetic repository')
+    parser.add_argument('--authors', type=int, default=30,
+                        help='number of authors')
+    parser.add_argument('--files', type=int, default=200,
+                        help='number of files')
+    parser.add_argument('--bugs', type=int, default=200,
+                        help='number of bugs')
+    parser.add_argument('--replay', type=int, default=50,
+                        help='number of replayed changesets')
+    parser.add_argument('--number', type=int, default=5,
+                        help='number of suggested reviewers')
+    parser.add_argument('--min-lines', type=int, default=50,
+                        help='files with at least this number of lines '
+                             'are approximated')
+    parser.add_argument('--modes', nargs='+', default=sorted(MODES.keys()),
+                        choices=sorted(MODES.keys()),
+                        help='the modes to compare')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic data')
+    parser.add_argument('--output', default='replay_results.json',
+                        help='JSON file where the results are appended')
+    args = parser.parse_args()
+    # the computations are timed, not the memoization of their results
+    bench.no_memoization()
+
+    tmp = tempfile.mkdtemp(prefix='mozreviewers-replay-')
+    server = None
+    modes = list(args.modes)
+    try:
+        if args.repo:
+            from mozreviewers.app import app
+            snapshot_path = args.snapshot
+            if not snapshot_path and 'snapshot' in modes:
+                modes.remove('snapshot')
+            changesets = get_changesets(args.repo, args.revrange,
+                                        args.replay)
+        else:
+            os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+                tmp, 'replay.db')
+            repo = os.path.join(tmp, 'repo')
+            upstreams = fixtures.Upstreams(fixtures.get_authors(args.authors),
+                                           seed=args.seed, repo=repo)
+            server, url = fixtures.start_upstreams(upstreams)
+            fixtures.use_upstreams(url)
+            from mozreviewers.app import app
+            with app.app_context():
+                changesets, snapshot_path = setup_synthetic(args, tmp, url)
+
+        with app.app_context():
+            results = replay(app, changesets, modes, args.number,
+                             snapshot_path)
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(tmp)
+
+    params = {k: v for k, v in vars(args).items() if k != 'output'}
+    params['changesets'] = len(changesets)
+    run = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'revision': bench.get_revision(),
+           'python': platform.python_version(),
+           'params': params,
+           'results': results}
+
+    runs = []
+    if os.path.isfile(args.output):
+        with open(args.output, 'r') as In:
+            runs = json.load(In)
+    runs.append(run)
+    with open(args.output, 'w') as Out:
+        json.dump(runs, Out, indent=1)
+
+    print('{} changesets, top {}'.format(len(changesets), args.number))
+    for mode in modes:
+        r = results[mode]
+        print('{}: hit rate={:.3f}, recall={:.3f}, p50={:.4f}s, '
+              'p95={:.4f}s'.format(mode, r['hit_rate'], r['recall'],
+                                   r['p50'], r['p95']))
+
+
+if __name__ == '__main__':
+    main()
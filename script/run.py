@@ -1,5 +1,27 @@
 #!/usr/bin/python
 
+import argparse
 from mozreviewers import collect
 
-collect.update()
+
+parser = argparse.ArgumentParser(description='Update the reviewers data')
+parser.add_argument('-p', '--profile', action='store_true',
+                    help='write a timing report (and pstats dumps) '
+                         'for each stage')
+parser.add_argument('-f', '--full', action='store_true',
+                    help='recompute the mapping for all the authors')
+parser.add_argument('-d', '--daemon', action='store_true',
+                    help='keep running and process the new changesets '
+                         'by batches')
+parser.add_argument('--interval', type=int, default=None,
+                    help='seconds between two pulls in daemon mode')
+parser.add_argument('--batch', type=int, default=None,
+                    help='maximum number of changesets per batch '
+                         'in daemon mode')
+args = parser.parse_args()
+
+if args.daemon:
+    collect.daemon(profile=args.profile, interval=args.interval,
+                   batch=args.batch)
+else:
+    collect.update(profile=args.profile, full=args.full)
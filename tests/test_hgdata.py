@@ -0,0 +1,95 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hglib
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'script'))
+
+import fixtures  # noqa
+from mozreviewers import hgdata  # noqa
+
+
+def commit(path, name, bugid):
+    client = hglib.open(path)
+    full = os.path.join(path, name)
+    with open(full, 'w') as Out:
+        Out.write(name + '\n')
+    client.add([full.encode('utf-8')])
+    msg = 'Bug {} - Add {}; r=dev0'.format(bugid, name)
+    client.commit(message=msg.encode('utf-8'),
+                  user=fixtures.get_authors(1)[0][0].encode('utf-8'))
+    client.close()
+
+
+def push(path):
+    client = hglib.open(path)
+    client.push()
+    client.close()
+
+
+def collect(hgpaths, last_revs, nodes):
+    new_revs, _, _, patches, _, _ = hgdata.get_repos_info(hgpaths,
+                                                          last_revs, nodes)
+    last_revs.update(new_revs)
+    return sorted(p['node'] for p in patches)
+
+
+def make_repos(tmpdir):
+    # autoland is a clone of mozilla-central with its own changesets,
+    # which are pushed to mozilla-central later
+    central = str(tmpdir.join('central'))
+    autoland = str(tmpdir.join('autoland'))
+    authors = fixtures.get_authors(3)
+    origin = fixtures.make_hg_repo(central, 20, authors,
+                                   fixtures.get_files(10), 5)
+    hglib.clone(source=origin.encode('utf-8'),
+                dest=autoland.encode('utf-8'))
+    return central, autoland
+
+
+def test_collected_together(tmpdir):
+    central, autoland = make_repos(tmpdir)
+    commit(autoland, 'a.txt', 1000000)
+    last_revs, nodes = {}, {}
+    patches = collect([central, autoland], last_revs, nodes)
+    assert len(patches) == 20
+    assert len(set(patches)) == 20
+
+
+def test_added_repository(tmpdir):
+    central, autoland = make_repos(tmpdir)
+    last_revs, nodes = {}, {}
+    assert len(collect([central], last_revs, nodes)) == 19
+
+    # the shared history is older than the nodes kept and isn't counted
+    # again
+    nodes.clear()
+    assert collect([central, autoland], last_revs, nodes) == []
+    assert autoland in last_revs
+
+    commit(autoland, 'a.txt', 1000000)
+    commit(autoland, 'b.txt', 1000001)
+    assert len(collect([central, autoland], last_revs, nodes)) == 2
+
+    # landed in mozilla-central
+    push(autoland)
+    assert collect([central, autoland], last_revs, nodes) == []
+
+
+def test_repository_behind(tmpdir):
+    central, autoland = make_repos(tmpdir)
+    commit(autoland, 'a.txt', 1000000)
+    push(autoland)
+    last_revs, nodes = {}, {}
+    assert len(collect([central], last_revs, nodes)) == 20
+
+    # autoland is far behind: its changesets aren't in nodes anymore
+    client = hglib.open(autoland)
+    last_revs[autoland] = client.log(revrange='0')[0][1].decode('ascii')
+    client.close()
+    nodes.clear()
+    assert collect([central, autoland], last_revs, nodes) == []
@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import pytest
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'script'))
+
+import fixtures  # noqa
+
+
+PATCH = '''diff --git a/dom/a.cpp b/dom/a.cpp
+--- a/dom/a.cpp
++++ b/dom/a.cpp
+@@ -1,1 +1,1 @@
+-x
++y
+'''
+
+NEW_FILE = '''diff --git a/dom/new.cpp b/dom/new.cpp
+new file mode 100644
+--- /dev/null
++++ b/dom/new.cpp
+@@ -0,0 +1,1 @@
++y
+'''
+
+
+@pytest.fixture(scope='module')
+def app():
+    tmp = tempfile.mkdtemp(prefix='mozreviewers-test-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'test.db')
+    authors = fixtures.get_authors(4)
+    server, url = fixtures.start_upstreams(fixtures.Upstreams(authors))
+    fixtures.use_upstreams(url)
+
+    from mozreviewers.app import app
+    from mozreviewers import models
+    with app.app_context():
+        models.create()
+        models.Authors.post({'command': 'create',
+                             'data': {'toinsert': dict(authors),
+                                      'torm': []}})
+        filestats = {'dom/a.cpp': {'dev1@example.com': 2.,
+                                   'dev2@example.com': 1.}}
+        models.FilesStats.post({'command': 'create',
+                                'data': filestats})
+        pc = {'product': 'Core',
+              'component': 'DOM'}
+        scores = {'Core::DOM': dict(pc, scores={'dev3@example.com': 5.})}
+        models.ComponentsStats.post({'command': 'create',
+                                     'data': {'scores': scores,
+                                              'bugs': {'1': pc}}})
+        yield app
+    server.shutdown()
+
+
+def get_nicks(patch, **kwargs):
+    from mozreviewers import reviewers
+
+    payload = dict(kwargs, patch=patch, bzauthor='dev0@example.com',
+                   annotations=False)
+    return [r['nick_name'] for r in reviewers.get(payload)['reviewers']]
+
+
+def test_component_not_used_with_stats(app):
+    assert get_nicks(PATCH) == [':dev1', ':dev2']
+    assert get_nicks(PATCH, bugid=1) == [':dev1', ':dev2']
+
+
+def test_component_for_new_files(app):
+    assert get_nicks(NEW_FILE) == []
+    assert get_nicks(NEW_FILE, bugid=1) == [':dev3']